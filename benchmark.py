@@ -0,0 +1,504 @@
+import os
+import json
+import shutil
+import tempfile
+import time
+import argparse
+import itertools
+import resource
+import platform
+import subprocess
+import tracemalloc
+import multiprocessing
+from importlib import import_module
+
+import numpy as np
+import tensorflow as tf
+
+import dataset
+import network
+
+
+model_names = ['gan', 'cgan', 'acgan', 'wgan', 'wgangp', 'dragan']
+
+
+def get_session_config(intra_op_threads, inter_op_threads):
+    return tf.ConfigProto(intra_op_parallelism_threads=intra_op_threads,
+                          inter_op_parallelism_threads=inter_op_threads)
+
+
+def build_model(model_name, sess_config, output_dir, **options):
+    # checkpoints and assets go to output_dir, never next to real training output
+    mnist = dataset.synthetic_mnist()
+    module_name = import_module(model_name)
+    gan_class = getattr(module_name, model_name.upper())
+    net = gan_class(model_name, 'synthetic', mnist, 1, sess_config=sess_config, output_dir=output_dir, **options)
+    return net
+
+
+def time_steps(net, sess, fd, steps, warmup):
+    for step in range(warmup):
+        net.train_step(sess, fd, step)
+
+    start_time = time.perf_counter()
+    for step in range(steps):
+        net.train_step(sess, fd, step)
+    return time.perf_counter() - start_time
+
+
+def time_calls(run, steps, warmup):
+    for _ in range(warmup):
+        run()
+
+    latencies = []
+    for _ in range(steps):
+        start_time = time.perf_counter()
+        run()
+        latencies.append(time.perf_counter() - start_time)
+    return np.array(latencies)
+
+
+def latency_summary(latencies):
+    # milliseconds
+    latencies = latencies * 1000.0
+    return {
+        'mean': float(np.mean(latencies)),
+        'p50': float(np.percentile(latencies, 50)),
+        'p90': float(np.percentile(latencies, 90)),
+        'p99': float(np.percentile(latencies, 99)),
+    }
+
+
+def bench_fused(args, sess_config):
+    # same graph, same batch: only the number of session calls per step differs
+    results = []
+    for model_name in args.models:
+        net = build_model(model_name, sess_config, args.scratch_dir, fused_step=True)
+        fd = net.next_feed()
+
+        with tf.Session(config=sess_config) as sess:
+            sess.run(tf.global_variables_initializer())
+
+            result = {'model': model_name, 'steps': args.steps}
+            for fused_step in [False, True]:
+                net.fused_step = fused_step
+                elapsed_time = time_steps(net, sess, fd, args.steps, args.warmup)
+                result['fused' if fused_step else 'unfused'] = args.steps / elapsed_time
+
+        result['speedup'] = result['fused'] / result['unfused']
+        print('{:<8s} unfused: {:8.2f} steps/s, fused: {:8.2f} steps/s, speedup: {:.3f}x'.format(
+            model_name, result['unfused'], result['fused'], result['speedup']))
+        results.append(result)
+    return results
+
+
+def bench_clip(args, sess_config):
+    # per critic iteration latency: weight clipping as its own session call before the update (as it used to be)
+    # vs folded into the update op
+    net = build_model('wgan', sess_config, args.scratch_dir)
+    fd = net.next_feed()
+
+    d_vars = net.update_vars[0]
+    separate_clip = [p.assign(tf.clip_by_value(p, -0.01, 0.01)) for p in d_vars]
+    with tf.control_dependencies(tf.get_collection(tf.GraphKeys.UPDATE_OPS)):
+        unclipped_opt = net.optimizers[0].minimize(net.d_loss, var_list=d_vars)
+
+    def separate():
+        sess.run(separate_clip)
+        sess.run([unclipped_opt, net.d_loss], feed_dict=fd)
+
+    def folded():
+        sess.run([net.d_opt, net.d_loss], feed_dict=fd)
+
+    with tf.Session(config=sess_config) as sess:
+        sess.run(tf.global_variables_initializer())
+        result = {'model': 'wgan', 'steps': args.steps}
+        for key, run in [('separate', separate), ('folded', folded)]:
+            result[key] = latency_summary(time_calls(run, args.steps, args.warmup))
+            print('{:<8s} critic step latency (ms) mean: {mean:7.3f}, p50: {p50:7.3f}, p90: {p90:7.3f}, '
+                  'p99: {p99:7.3f}'.format(key, **result[key]))
+    return [result]
+
+
+def legacy_batch(split, batch_size, z_dim):
+    # feed preparation as it used to be done: float64 rescale and noise, converted again when fed
+    batch_x, batch_y = split.next_batch(batch_size)
+    batch_x = np.reshape(batch_x, (-1, 28, 28, 1))
+    batch_x = batch_x * 2.0 - 1.0
+    batch_z = np.random.uniform(-1, 1, size=(batch_size, z_dim))
+    return batch_x, batch_y, batch_z
+
+
+def traced_peak(run, steps, warmup):
+    for _ in range(warmup):
+        run()
+
+    # numpy reports its buffers to tracemalloc, the peak is everything allocated on top of the warmed up state
+    tracemalloc.start()
+    for _ in range(steps):
+        run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def bench_alloc(args, sess_config):
+    # steady state feed preparation must not allocate per step: its traced peak has to stay below the size of
+    # one float32 image batch, any batch sized temporary breaks that. what remains is the fixed size ufunc casting
+    # buffer and the new permutation at epoch boundaries (8 bytes per example, 80 KB here)
+    mnist = dataset.synthetic_mnist()
+    batches = dataset.BatchBuffers(mnist.train, args.batch_size, args.z_dim)
+    limit = batches.images.nbytes
+
+    result = {'steps': args.steps, 'batch_size': args.batch_size, 'limit_bytes': limit}
+    result['buffers_peak_bytes'] = traced_peak(batches.next_batch, args.steps, args.warmup)
+    result['legacy_peak_bytes'] = traced_peak(lambda: legacy_batch(mnist.train, args.batch_size, args.z_dim),
+                                              args.steps, args.warmup)
+    print('traced peak over {:d} steps, buffers: {:d} bytes, legacy: {:d} bytes (limit: {:d} bytes)'.format(
+        args.steps, result['buffers_peak_bytes'], result['legacy_peak_bytes'], limit))
+
+    if result['buffers_peak_bytes'] >= limit:
+        raise RuntimeError('feed preparation allocates per step: {:d} bytes traced'.format(
+            result['buffers_peak_bytes']))
+    return [result]
+
+
+def bench_graph(args, sess_config):
+    # the training loop must not grow the graph: op count at the end of every epoch of a short real run, the same
+    # at each one (train() adds its initializer before the first step and then finalizes the graph, an op added
+    # in the loop fails the run before the check does)
+    results = []
+    for model_name in args.models:
+        gan_class = getattr(import_module(model_name), model_name.upper())
+
+        class OpCounter(gan_class):
+            # evaluate_epoch runs once at the end of every epoch
+            def evaluate_epoch(self, sess, epoch, g_steps):
+                self.op_counts.append(len(sess.graph.get_operations()))
+                return super().evaluate_epoch(sess, epoch, g_steps)
+
+        mnist = dataset.synthetic_mnist(num_examples=args.examples, validation_size=100)
+        net = OpCounter(model_name, 'synthetic', mnist, args.epochs, sess_config=sess_config, resume=False,
+                        output_dir=args.scratch_dir)
+        net.op_counts = [len(tf.get_default_graph().get_operations())]
+        net.train()
+
+        result = {'model': model_name, 'epochs': args.epochs, 'op_counts': net.op_counts}
+        print('{:<8s} ops after building: {:d}, after every epoch: {:s}'.format(
+            model_name, net.op_counts[0], ', '.join(str(count) for count in net.op_counts[1:])))
+        results.append(result)
+
+        epoch_counts = net.op_counts[1:]
+        if len(epoch_counts) != args.epochs or len(set(epoch_counts)) != 1:
+            raise RuntimeError('{:s} graph grows during training: {}'.format(model_name, net.op_counts))
+    return results
+
+
+def network_ops(network_name, conditional, is_training, batch_size):
+    # inputs live in variables: nothing is fed per call
+    y = None
+    if conditional:
+        labels = tf.one_hot(tf.random_uniform([batch_size], maxval=10, dtype=tf.int32), 10)
+        y = tf.Variable(labels, trainable=False)
+
+    if network_name == 'generator':
+        z = tf.Variable(tf.random_uniform([batch_size, 100], minval=-1.0, maxval=1.0), trainable=False)
+        out = network.generator(z, y=y, reuse=False, is_training=is_training)
+    else:
+        x = tf.Variable(tf.random_uniform([batch_size, 28, 28, 1], minval=-1.0, maxval=1.0), trainable=False)
+        out, _ = network.discriminator(x, y=y, reuse=False, is_training=is_training)
+
+    # gradients only, no optimizer: the cost of the backward pass itself. the fetch has to read every gradient, a
+    # group of them only has control dependencies on stateless ops, which grappler prunes
+    gradients = tf.gradients(tf.reduce_mean(out), tf.trainable_variables())
+    gradients_sum = tf.add_n([tf.reduce_sum(gradient) for gradient in gradients])
+    return {'forward': out.op, 'forward+backward': gradients_sum}
+
+
+def bench_networks(args, sess_config):
+    # images/sec of a single network, per configuration and thread count
+    results = []
+    configs = itertools.product(args.networks, [False, True], ['training', 'inference'], args.batch_sizes)
+    for network_name, conditional, mode, batch_size in configs:
+        with tf.Graph().as_default():
+            ops = network_ops(network_name, conditional, mode == 'training', batch_size)
+            init_op = tf.global_variables_initializer()
+
+            for threads in args.threads:
+                with tf.Session(config=get_session_config(threads, args.inter_op_threads)) as sess:
+                    sess.run(init_op)
+                    for pass_name, op in ops.items():
+                        latencies = time_calls(lambda: sess.run(op), args.steps, args.warmup)
+                        result = {
+                            'network': network_name,
+                            'conditional': conditional,
+                            'mode': mode,
+                            'pass': pass_name,
+                            'batch_size': batch_size,
+                            'threads': threads,
+                            'images_per_sec': batch_size * args.steps / float(np.sum(latencies)),
+                            'latency_ms': latency_summary(latencies),
+                        }
+                        print('{:<13s} {:<13s} {:<9s} {:<16s} batch: {:4d}, threads: {:3d}, {:10.1f} images/s'.format(
+                            network_name, 'conditional' if conditional else 'unconditional', mode, pass_name,
+                            batch_size, threads, result['images_per_sec']))
+                        results.append(result)
+    return results
+
+
+def copy_batches(n_batches, batch_size=128, z_dim=100):
+    # copies: the batch buffers are overwritten at every step
+    batches = dataset.BatchBuffers(dataset.synthetic_mnist().train, batch_size, z_dim, seed=0)
+    return [tuple(array.copy() for array in batches.next_batch()) for _ in range(n_batches)]
+
+
+def batch_feed(net, batch):
+    batch_x, batch_y, batch_z = batch
+    fd = {net.inputs_x: batch_x, net.inputs_z: batch_z}
+    if net.conditional:
+        fd[net.inputs_y] = batch_y
+    return fd
+
+
+def precision_run(model_name, precision, sess_config, init_values, batches, args):
+    # from the same initial weights on the same batches: losses of a short run, generator output after it on the
+    # noise (and labels) of the first batch, then training images/sec
+    net = build_model(model_name, sess_config, args.scratch_dir, precision=precision)
+    with tf.Session(config=sess_config) as sess:
+        sess.run(tf.global_variables_initializer())
+        if init_values is None:
+            init_values = {var.op.name: value for var, value in zip(tf.global_variables(),
+                                                                    sess.run(tf.global_variables()))}
+        for var in tf.global_variables():
+            var.load(init_values[var.op.name], sess)
+
+        losses = np.array([net.train_step(sess, batch_feed(net, batch), step) for step, batch in enumerate(batches)],
+                          dtype=np.float64)
+        fd = batch_feed(net, batches[0])
+        samples = sess.run(net.g_sample, feed_dict=fd)
+        elapsed_time = time_steps(net, sess, fd, args.steps, args.warmup)
+    return init_values, samples, losses, args.steps * net.batch_size / elapsed_time
+
+
+def bench_precision(args, sess_config):
+    # bfloat16 networks (float32 master weights and batch norm) against float32: accuracy and images/sec
+    results = []
+    for model_name in args.models:
+        batches = copy_batches(args.check_steps)
+        init_values, samples, losses, images_per_sec = precision_run(model_name, 'float32', sess_config, None,
+                                                                     batches, args)
+        _, bf16_samples, bf16_losses, bf16_images_per_sec = precision_run(model_name, 'bfloat16', sess_config,
+                                                                          init_values, batches, args)
+
+        # losses of skipped updates (critic schedules) are None, compared where both runs have one
+        valid = ~(np.isnan(losses) | np.isnan(bf16_losses))
+        result = {
+            'model': model_name,
+            'check_steps': args.check_steps,
+            'sample_max_abs_diff': float(np.max(np.abs(bf16_samples - samples))),
+            'sample_mean_abs_diff': float(np.mean(np.abs(bf16_samples - samples))),
+            'loss_mean_abs_diff': float(np.mean(np.abs(bf16_losses - losses)[valid])),
+            'loss_mean_abs': float(np.mean(np.abs(losses)[valid])),
+            'loss_relative_diff': float(np.mean(np.abs(bf16_losses - losses)[valid]) /
+                                        max(np.mean(np.abs(losses)[valid]), 1e-6)),
+            'float32_images_per_sec': images_per_sec,
+            'bfloat16_images_per_sec': bf16_images_per_sec,
+            'speedup': bf16_images_per_sec / images_per_sec,
+        }
+        print('{:<8s} samples mean abs diff: {:.4f} (max {:.4f}), losses mean abs diff: {:.4f} of {:.4f} ({:.3f}), '
+              'float32: {:9.1f} images/s, bfloat16: {:9.1f} images/s, speedup: {:.3f}x'.format(
+                  model_name, result['sample_mean_abs_diff'], result['sample_max_abs_diff'],
+                  result['loss_mean_abs_diff'], result['loss_mean_abs'], result['loss_relative_diff'],
+                  images_per_sec, bf16_images_per_sec, result['speedup']))
+        results.append(result)
+
+        if result['sample_mean_abs_diff'] > args.tolerance:
+            raise RuntimeError('{:s} bfloat16 samples after {:d} steps are off by {:.4f} on average '
+                               '(tolerance: {:.4f})'.format(model_name, args.check_steps,
+                                                            result['sample_mean_abs_diff'], args.tolerance))
+        if result['loss_relative_diff'] > args.loss_tolerance:
+            raise RuntimeError('{:s} bfloat16 losses diverge from float32 by {:.3f} of their mean '
+                               '(tolerance: {:.3f})'.format(model_name, result['loss_relative_diff'],
+                                                           args.loss_tolerance))
+    return results
+
+
+def process_age():
+    # seconds since this process was created: interpreter start and imports (tensorflow's) included. linux only,
+    # 0 elsewhere. starttime is the 22nd field of /proc/self/stat, in clock ticks since boot
+    try:
+        with open('/proc/self/stat') as f:
+            start_ticks = float(f.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+    except OSError:
+        return 0.0
+    return uptime - start_ticks / os.sysconf('SC_CLK_TCK')
+
+
+def train_worker(job):
+    # runs in its own process: peak RSS and time to first step belong to this model only
+    model_name, options, steps, warmup, intra_op_threads, inter_op_threads, output_dir = job
+    startup_time = process_age()
+    start_time = time.perf_counter() - startup_time
+
+    sess_config = get_session_config(intra_op_threads, inter_op_threads)
+    net = build_model(model_name, sess_config, output_dir, **options)
+    build_time = time.perf_counter() - start_time
+
+    with tf.Session(config=sess_config) as sess:
+        sess.run(tf.global_variables_initializer())
+        if net.pipeline is not None:
+            net.pipeline.initialize(sess)
+        sess.graph.finalize()
+
+        # the same calls as the training loop, a new batch every step
+        net.train_step(sess, net.next_feed(), 0)
+        first_step_time = time.perf_counter() - start_time
+
+        for step in range(1, 1 + warmup):
+            net.train_step(sess, net.next_feed(), step)
+
+        steps_start_time = time.perf_counter()
+        for step in range(1 + warmup, 1 + warmup + steps):
+            net.train_step(sess, net.next_feed(), step)
+        elapsed_time = time.perf_counter() - steps_start_time
+
+    # kilobytes on linux
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {
+        'model': model_name,
+        'options': options,
+        'steps': steps,
+        'batch_size': net.batch_size,
+        'steps_per_sec': steps / elapsed_time,
+        'images_per_sec': steps * net.batch_size / elapsed_time,
+        'startup_s': startup_time,
+        'build_s': build_time - startup_time,
+        'time_to_first_step_s': first_step_time,
+        'peak_rss_mb': peak_rss / 1024.0,
+    }
+
+
+def bench_train(args, sess_config):
+    # training steps of every model on synthetic data, one fresh process per model
+    options = {'fused_step': args.fused_step, 'input_mode': args.input_mode}
+    jobs = [(model_name, options, args.steps, args.warmup, args.intra_op_threads, args.inter_op_threads,
+             args.scratch_dir)
+            for model_name in args.models]
+
+    results = []
+    context = multiprocessing.get_context('spawn')
+    pool = context.Pool(processes=1, maxtasksperchild=1)
+    try:
+        for result in pool.imap(train_worker, jobs):
+            print('{:<8s} {:8.2f} steps/s, {:9.1f} images/s, first step after {:6.2f}s, peak rss: {:8.1f} MB'.format(
+                result['model'], result['steps_per_sec'], result['images_per_sec'], result['time_to_first_step_s'],
+                result['peak_rss_mb']))
+            results.append(result)
+    finally:
+        pool.close()
+        pool.join()
+    return results
+
+
+def environment():
+    # enough to tell runs apart when tracking regressions across commits
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'tensorflow': tf.__version__,
+        'numpy': np.__version__,
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpu_count': multiprocessing.cpu_count(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='training benchmarks on synthetic MNIST shaped data')
+    parser.add_argument('--output', type=str, default=None, help='write results as json')
+    parser.add_argument('--intra-op-threads', type=int, default=0)
+    parser.add_argument('--inter-op-threads', type=int, default=0)
+    subparsers = parser.add_subparsers(dest='benchmark')
+
+    fused_parser = subparsers.add_parser('fused', help='steps/sec with separate vs fused D/G updates')
+    fused_parser.add_argument('--models', nargs='+', default=model_names, choices=model_names)
+    fused_parser.add_argument('--steps', type=int, default=200)
+    fused_parser.add_argument('--warmup', type=int, default=20)
+    fused_parser.set_defaults(run=bench_fused)
+
+    clip_parser = subparsers.add_parser('clip', help='WGAN critic step latency with separate vs folded clipping')
+    clip_parser.add_argument('--steps', type=int, default=500)
+    clip_parser.add_argument('--warmup', type=int, default=50)
+    clip_parser.set_defaults(run=bench_clip)
+
+    alloc_parser = subparsers.add_parser('alloc', help='check that feed preparation makes no per step allocations')
+    alloc_parser.add_argument('--steps', type=int, default=1000)
+    alloc_parser.add_argument('--warmup', type=int, default=10)
+    alloc_parser.add_argument('--batch-size', type=int, default=128)
+    alloc_parser.add_argument('--z-dim', type=int, default=100)
+    alloc_parser.set_defaults(run=bench_alloc)
+
+    graph_parser = subparsers.add_parser('graph', help='check that the op count stays constant across epochs')
+    graph_parser.add_argument('--models', nargs='+', default=model_names, choices=model_names)
+    graph_parser.add_argument('--epochs', type=int, default=3)
+    graph_parser.add_argument('--examples', type=int, default=512, help='training examples per epoch')
+    graph_parser.set_defaults(run=bench_graph)
+
+    networks_parser = subparsers.add_parser('networks', help='generator & discriminator images/sec, forward and '
+                                                             'forward+backward, across batch sizes and threads')
+    networks_parser.add_argument('--networks', nargs='+', default=['generator', 'discriminator'],
+                                 choices=['generator', 'discriminator'])
+    networks_parser.add_argument('--batch-sizes', nargs='+', type=int, default=[32, 128, 256])
+    networks_parser.add_argument('--threads', nargs='+', type=int, default=[1, multiprocessing.cpu_count()],
+                                 help='intra-op thread counts, each gets its own session')
+    networks_parser.add_argument('--steps', type=int, default=50)
+    networks_parser.add_argument('--warmup', type=int, default=5)
+    networks_parser.set_defaults(run=bench_networks)
+
+    train_parser = subparsers.add_parser('train', help='end to end training steps/sec, images/sec, peak rss and '
+                                                       'time to first step, one process per model')
+    train_parser.add_argument('--models', nargs='+', default=model_names, choices=model_names)
+    train_parser.add_argument('--steps', type=int, default=200)
+    train_parser.add_argument('--warmup', type=int, default=10)
+    train_parser.add_argument('--fused-step', action='store_true')
+    train_parser.add_argument('--input-mode', type=str, default='feed', choices=['feed', 'dataset'])
+    train_parser.set_defaults(run=bench_train)
+
+    precision_parser = subparsers.add_parser('precision', help='bfloat16 vs float32 training: sample and loss '
+                                                               'differences on a short run, images/sec')
+    precision_parser.add_argument('--models', nargs='+', default=model_names, choices=model_names)
+    precision_parser.add_argument('--check-steps', type=int, default=50, help='training steps compared')
+    precision_parser.add_argument('--steps', type=int, default=100)
+    precision_parser.add_argument('--warmup', type=int, default=10)
+    precision_parser.add_argument('--tolerance', type=float, default=0.05,
+                                  help='largest mean abs difference of generator samples (in -1 ~ 1)')
+    precision_parser.add_argument('--loss-tolerance', type=float, default=0.1,
+                                  help='largest mean abs difference of the losses, relative to their mean abs value')
+    precision_parser.set_defaults(run=bench_precision)
+
+    args = parser.parse_args()
+    if args.benchmark is None:
+        parser.error('choose a benchmark')
+
+    sess_config = get_session_config(args.intra_op_threads, args.inter_op_threads)
+    # checkpoints, sample grids and loss plots of the benchmarked trainers, removed afterwards
+    args.scratch_dir = tempfile.mkdtemp(prefix='gan-benchmark-')
+    try:
+        results = args.run(args, sess_config)
+    finally:
+        shutil.rmtree(args.scratch_dir, ignore_errors=True)
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump({'benchmark': args.benchmark, 'environment': environment(), 'results': results}, f, indent=2)
+    return
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+import os
+import time
+import pickle
+import numpy as np
+import tensorflow as tf
+
+
+class Checkpointer(object):
+    # saves all variables every N epochs and/or N minutes, keeping the last K checkpoints, together with
+    # the python side training state (step counter, loss history, RNG state, batch cursor) needed to resume
+    def __init__(self, ckpt_dir, every_epochs=1, every_minutes=None, keep_last=3):
+        self.ckpt_dir = os.path.abspath(ckpt_dir)
+        os.makedirs(self.ckpt_dir, exist_ok=True)
+        self.ckpt_prefix = os.path.join(self.ckpt_dir, 'model')
+        self.every_epochs = every_epochs
+        self.every_minutes = every_minutes
+
+        # must be created while the graph can still grow
+        self.saver = tf.train.Saver(max_to_keep=keep_last)
+        self.last_save_time = time.time()
+
+        # keep rotating the checkpoints an earlier process left here, whether or not they are resumed from,
+        # otherwise their files are never deleted
+        ckpt = tf.train.get_checkpoint_state(self.ckpt_dir)
+        if ckpt is not None:
+            self.saver.recover_last_checkpoints(list(ckpt.all_model_checkpoint_paths))
+
+    @staticmethod
+    def state_fn(ckpt_fn):
+        return '{:s}.state'.format(ckpt_fn)
+
+    def epoch_due(self, epoch):
+        return bool(self.every_epochs) and (epoch + 1) % self.every_epochs == 0
+
+    def time_due(self):
+        return bool(self.every_minutes) and time.time() - self.last_save_time >= self.every_minutes * 60.0
+
+    def restore(self, sess):
+        ckpt = tf.train.get_checkpoint_state(self.ckpt_dir)
+        if ckpt is None or ckpt.model_checkpoint_path is None:
+            return None
+
+        self.saver.restore(sess, ckpt.model_checkpoint_path)
+
+        with open(self.state_fn(ckpt.model_checkpoint_path), 'rb') as f:
+            state = pickle.load(f)
+        np.random.set_state(state['np_random'])
+        self.last_save_time = time.time()
+        return state
+
+    def save(self, sess, step, state):
+        state = dict(state, np_random=np.random.get_state())
+
+        # state file first: a checkpoint listed in the index always has its state next to it
+        ckpt_fn = '{:s}-{:d}'.format(self.ckpt_prefix, step)
+        tmp_fn = '{:s}.tmp'.format(self.state_fn(ckpt_fn))
+        with open(tmp_fn, 'wb') as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_fn, self.state_fn(ckpt_fn))
+
+        self.saver.save(sess, self.ckpt_prefix, global_step=step, write_meta_graph=False)
+
+        # drop state files of checkpoints the saver rotated out
+        kept = set(self.state_fn(fn) for fn in self.saver.last_checkpoints)
+        prefix = os.path.basename(self.ckpt_prefix) + '-'
+        for fn in os.listdir(self.ckpt_dir):
+            fn = os.path.join(self.ckpt_dir, fn)
+            if os.path.basename(fn).startswith(prefix) and fn.endswith('.state') and fn not in kept:
+                os.remove(fn)
+
+        self.last_save_time = time.time()
+        return
@@ -0,0 +1,228 @@
+import os
+import gzip
+import collections
+import numpy as np
+import tensorflow as tf
+
+
+Datasets = collections.namedtuple('Datasets', ['train', 'validation', 'test'])
+
+# gzip IDX files as distributed by MNIST & fashion-MNIST, and the uint8 .npy files they are decoded into
+_idx_files = {
+    'train-images': 'train-images-idx3-ubyte.gz',
+    'train-labels': 'train-labels-idx1-ubyte.gz',
+    'test-images': 't10k-images-idx3-ubyte.gz',
+    'test-labels': 't10k-labels-idx1-ubyte.gz',
+}
+
+# decoded arrays shared by every loader in this process, keyed by (dataset_base_dir, mnist_type)
+_array_cache = {}
+
+
+class MNISTSplit(object):
+    # drop-in for the tutorial DataSet: keeps the uint8 arrays as they are (possibly memory-mapped)
+    # and converts only the requested batch to float32
+    def __init__(self, images, labels, n_classes=10):
+        self.images_u8 = images
+        self.labels_u8 = labels
+        self.n_classes = n_classes
+        self.num_examples = images.shape[0]
+        self.epochs_completed = 0
+        self._index_in_epoch = 0
+        self._perm = None
+
+    @property
+    def images(self):
+        return self.to_float(self.images_u8)
+
+    @property
+    def labels(self):
+        return self.to_one_hot(self.labels_u8)
+
+    @staticmethod
+    def to_float(images):
+        # [0, 255] uint8 ==> [0, 1] float32
+        return np.multiply(images, 1.0 / 255.0, dtype=np.float32)
+
+    def to_one_hot(self, labels):
+        one_hot = np.zeros(shape=[labels.shape[0], self.n_classes], dtype=np.float32)
+        one_hot[np.arange(labels.shape[0]), labels] = 1.0
+        return one_hot
+
+    def _new_perm(self, shuffle):
+        if shuffle:
+            return np.random.permutation(self.num_examples)
+        return np.arange(self.num_examples)
+
+    def next_indices(self, batch_size, shuffle=True):
+        if self._perm is None:
+            self._perm = self._new_perm(shuffle)
+
+        start = self._index_in_epoch
+        if start + batch_size > self.num_examples:
+            # finish current epoch and fill up the batch from the next one
+            rest = self._perm[start:]
+            self.epochs_completed += 1
+            self._perm = self._new_perm(shuffle)
+            self._index_in_epoch = batch_size - rest.shape[0]
+            return np.concatenate((rest, self._perm[:self._index_in_epoch]))
+
+        self._index_in_epoch += batch_size
+        return self._perm[start:self._index_in_epoch]
+
+    def next_batch(self, batch_size, shuffle=True):
+        indices = self.next_indices(batch_size, shuffle)
+        return self.to_float(self.images_u8[indices]), self.to_one_hot(self.labels_u8[indices])
+
+    def get_state(self):
+        return {'epochs_completed': self.epochs_completed, 'index_in_epoch': self._index_in_epoch, 'perm': self._perm}
+
+    def set_state(self, state):
+        self.epochs_completed = state['epochs_completed']
+        self._index_in_epoch = state['index_in_epoch']
+        self._perm = state['perm']
+
+
+class BatchBuffers(object):
+    # float32 feed arrays allocated once and refilled in place at every step: images are gathered into a uint8
+    # scratch and rescaled to [-1, 1] straight into the float32 buffer, noise is sampled as float32
+    # the returned arrays are overwritten by the next call
+    def __init__(self, split, batch_size, z_dim, seed=None):
+        self.split = split
+        self.batch_size = batch_size
+        self.rng = np.random.default_rng(seed)
+
+        self._images_u8 = np.empty((batch_size,) + split.images_u8.shape[1:], dtype=np.uint8)
+        self._labels_u8 = np.empty((batch_size,), dtype=split.labels_u8.dtype)
+        self._rows = np.arange(batch_size)
+
+        self.images = np.empty((batch_size, 28, 28, 1), dtype=np.float32)
+        self.labels = np.empty((batch_size, split.n_classes), dtype=np.float32)
+        self.noise = np.empty((batch_size, z_dim), dtype=np.float32)
+        self._images_flat = self.images.reshape(self._images_u8.shape)
+
+    def fetch(self, shuffle=True):
+        indices = self.split.next_indices(self.batch_size, shuffle)
+
+        # mode='raise' would gather into a temporary first, the indices are always valid
+        np.take(self.split.images_u8, indices, axis=0, out=self._images_u8, mode='clip')
+        np.take(self.split.labels_u8, indices, out=self._labels_u8, mode='clip')
+
+    def prepare(self):
+        # [0, 255] uint8 ==> [-1, 1] float32
+        np.multiply(self._images_u8, 2.0 / 255.0, out=self._images_flat, dtype=np.float32)
+        np.subtract(self._images_flat, 1.0, out=self._images_flat)
+
+        # one hot labels
+        self.labels.fill(0.0)
+        self.labels[self._rows, self._labels_u8] = 1.0
+
+        # U[-1, 1) noise
+        self.rng.random(out=self.noise, dtype=np.float32)
+        np.multiply(self.noise, 2.0, out=self.noise)
+        np.subtract(self.noise, 1.0, out=self.noise)
+        return self.images, self.labels, self.noise
+
+    def next_batch(self, shuffle=True):
+        self.fetch(shuffle)
+        return self.prepare()
+
+    def get_state(self):
+        return dict(self.split.get_state(), rng=self.rng.bit_generator.state)
+
+    def set_state(self, state):
+        self.split.set_state(state)
+        self.rng.bit_generator.state = state['rng']
+
+
+class InputPipeline(object):
+    # shuffling, batching, rescaling to [-1, 1] and noise sampling done by tf.data inside the graph
+    def __init__(self, split, batch_size, z_dim, n_parallel_calls=4, n_prefetch=2):
+        self.split = split
+        self.images_u8 = tf.placeholder(tf.uint8, split.images_u8.shape, name='pipeline_images')
+        self.labels_u8 = tf.placeholder(tf.uint8, split.labels_u8.shape, name='pipeline_labels')
+
+        def preprocess(images, labels):
+            images = tf.cast(images, tf.float32) * (2.0 / 255.0) - 1.0
+            images = tf.reshape(images, [batch_size, 28, 28, 1])
+            labels = tf.one_hot(labels, split.n_classes, dtype=tf.float32)
+            noise = tf.random_uniform([batch_size, z_dim], minval=-1.0, maxval=1.0)
+            return images, labels, noise
+
+        # repeat before batching, so every batch is full and epochs blend like the feed loader's do
+        pipeline = tf.data.Dataset.from_tensor_slices((self.images_u8, self.labels_u8))
+        pipeline = pipeline.shuffle(split.num_examples).repeat().batch(batch_size)
+        pipeline = pipeline.map(preprocess, num_parallel_calls=n_parallel_calls).prefetch(n_prefetch)
+
+        self.iterator = pipeline.make_initializable_iterator()
+        self.images, self.labels, self.noise = self.iterator.get_next()
+
+    def initialize(self, sess):
+        # the uint8 arrays are copied into the pipeline once, instead of being fed batch by batch
+        sess.run(self.iterator.initializer,
+                 feed_dict={self.images_u8: self.split.images_u8, self.labels_u8: self.split.labels_u8})
+
+
+def _read_idx(fn):
+    # IDX format: 2 zero bytes, dtype code, number of dims, then one big endian uint32 per dim
+    with gzip.open(fn, 'rb') as f:
+        data = f.read()
+    n_dims = data[3]
+    shape = np.frombuffer(data, dtype='>u4', count=n_dims, offset=4).astype(np.int64)
+    array = np.frombuffer(data, dtype=np.uint8, offset=4 + 4 * n_dims)
+    return array.reshape(shape[0], -1) if n_dims > 1 else array
+
+
+def _decode_to_npy(mnist_dir):
+    gz_fns = [os.path.join(mnist_dir, fn) for fn in _idx_files.values()]
+    if not all(os.path.isfile(fn) for fn in gz_fns):
+        # let the tutorial reader download the missing files once
+        from tensorflow.examples.tutorials.mnist import input_data
+        input_data.read_data_sets(mnist_dir, one_hot=True)
+
+    for key, gz_fn in _idx_files.items():
+        npy_fn = os.path.join(mnist_dir, '{:s}.npy'.format(key))
+        if os.path.isfile(npy_fn):
+            continue
+
+        # write next to the final name and rename, so concurrent readers never see a partial file
+        tmp_fn = '{:s}.{:d}.tmp.npy'.format(npy_fn[:-4], os.getpid())
+        np.save(tmp_fn, _read_idx(os.path.join(mnist_dir, gz_fn)))
+        os.replace(tmp_fn, npy_fn)
+
+
+def load_arrays(dataset_base_dir, mnist_type):
+    key = (os.path.abspath(dataset_base_dir), mnist_type)
+    if key not in _array_cache:
+        mnist_dir = os.path.join(dataset_base_dir, mnist_type)
+        _decode_to_npy(mnist_dir)
+
+        # read-only memory maps: every process using the same files shares the same page cache
+        _array_cache[key] = {k: np.load(os.path.join(mnist_dir, '{:s}.npy'.format(k)), mmap_mode='r')
+                             for k in _idx_files.keys()}
+    return _array_cache[key]
+
+
+def load_mnist(dataset_base_dir, mnist_type, validation_size=5000):
+    arrays = load_arrays(dataset_base_dir, mnist_type)
+
+    # same split as the tutorial reader: the first examples of the training set are used for validation
+    # every call gets its own batch cursors over the shared arrays
+    train_images, train_labels = arrays['train-images'], arrays['train-labels']
+    train = MNISTSplit(train_images[validation_size:], train_labels[validation_size:])
+    validation = MNISTSplit(train_images[:validation_size], train_labels[:validation_size])
+    test = MNISTSplit(arrays['test-images'], arrays['test-labels'])
+    return Datasets(train=train, validation=validation, test=test)
+
+
+def synthetic_mnist(num_examples=10000, validation_size=1000, n_classes=10, seed=0):
+    # random MNIST-shaped data, for benchmarks that must not depend on a download
+    rng = np.random.RandomState(seed)
+    n_total = num_examples + 2 * validation_size
+    images = rng.randint(0, 256, size=(n_total, 28 * 28)).astype(np.uint8)
+    labels = rng.randint(0, n_classes, size=(n_total,)).astype(np.uint8)
+
+    train = MNISTSplit(images[:num_examples], labels[:num_examples], n_classes)
+    validation = MNISTSplit(images[num_examples:-validation_size], labels[num_examples:-validation_size], n_classes)
+    test = MNISTSplit(images[-validation_size:], labels[-validation_size:], n_classes)
+    return Datasets(train=train, validation=validation, test=test)
@@ -0,0 +1,64 @@
+import math
+
+
+# metrics of evaluation.Evaluator that can drive early stopping, and whether lower values are better
+monitored_metrics = {'fid': True, 'kid': True, 'class_accuracy': False}
+
+
+class EarlyStopping(object):
+    # follows one quality metric over the periodic evaluations of a run: reports new best values (to keep that
+    # checkpoint) and a reason to stop when the metric stops improving for `patience` evaluations or when
+    # the predicted class histogram collapses below `min_class_entropy` (1: balanced classes, 0: a single class)
+    # everything is derived from the metrics history, so a resumed run replays it instead of checkpointing it
+    def __init__(self, monitor='fid', patience=None, min_improvement=0.0, min_class_entropy=None):
+        if monitor not in monitored_metrics:
+            raise ValueError('Either "fid", "kid" or "class_accuracy"')
+
+        self.monitor = monitor
+        self.lower_is_better = monitored_metrics[monitor]
+        self.patience = patience
+        self.min_improvement = min_improvement
+        self.min_class_entropy = min_class_entropy
+
+        self.best_value = None
+        self.best_epoch = None
+        self.n_stale = 0
+
+    def value(self, metrics):
+        # None when the monitored metric was not due at this evaluation
+        if self.monitor == 'class_accuracy':
+            return metrics['class_accuracy']['classifier']['accuracy'] if 'class_accuracy' in metrics else None
+        return metrics.get(self.monitor)
+
+    def improved(self, value):
+        if self.best_value is None:
+            return True
+        if self.lower_is_better:
+            return value < self.best_value - self.min_improvement
+        return value > self.best_value + self.min_improvement
+
+    def update(self, metrics):
+        # one evaluation's metrics ==> (new best value or not, reason to stop or None)
+        is_best = False
+        value = self.value(metrics)
+        if value is not None and not math.isnan(value):
+            if self.improved(value):
+                self.best_value, self.best_epoch, self.n_stale = value, metrics['epoch'], 0
+                is_best = True
+            else:
+                self.n_stale += 1
+
+        if self.min_class_entropy is not None and metrics.get('class_entropy', 1.0) < self.min_class_entropy:
+            return is_best, 'mode collapse, class entropy {:.3f} < {:.3f}'.format(metrics['class_entropy'],
+                                                                                  self.min_class_entropy)
+        if self.patience and self.n_stale >= self.patience:
+            return is_best, 'no {:s} improvement in {:d} evaluations, best {:.5f} at epoch {:d}'.format(
+                self.monitor, self.n_stale, self.best_value, self.best_epoch)
+        return is_best, None
+
+    def replay(self, metrics_history):
+        # state after the evaluations of a resumed run, and whether it had already stopped
+        stop_reason = None
+        for metrics in metrics_history:
+            _, stop_reason = self.update(metrics)
+        return stop_reason
@@ -0,0 +1,390 @@
+import os
+import json
+import time
+import hashlib
+import shutil
+import argparse
+
+import numpy as np
+import tensorflow as tf
+
+import utils
+import sample
+
+
+# bump when the extractor's architecture or training changes: cached weights and statistics are rebuilt
+extractor_version = 1
+
+
+def extractor_network(x, n_classes=10):
+    # small MNIST classifier, its last hidden layer is the feature space of the metrics
+    with tf.variable_scope('extractor'):
+        l1 = tf.layers.conv2d(x, filters=32, kernel_size=5, strides=2, padding='same', activation=tf.nn.relu)
+        l2 = tf.layers.conv2d(l1, filters=64, kernel_size=5, strides=2, padding='same', activation=tf.nn.relu)
+        l3 = tf.contrib.layers.flatten(l2)
+        features = tf.layers.dense(l3, units=128, activation=tf.nn.relu)
+        logits = tf.layers.dense(features, units=n_classes)
+        return features, logits
+
+
+class FeatureExtractor(object):
+    # trained once per dataset on its training split and cached under cache_dir, in its own graph & session
+    # so it can be used next to a finalized training graph
+    def __init__(self, cache_dir, mnist=None, sess_config=None, n_epochs=2, batch_size=128):
+        self.model_dir = os.path.join(cache_dir, 'extractor-v{:d}'.format(extractor_version))
+        self.batch_size = batch_size
+
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            tf.set_random_seed(0)
+            self.inputs_x = tf.placeholder(tf.float32, [None, 28, 28, 1], name='inputs_x')
+            self.inputs_label = tf.placeholder(tf.int64, [None], name='inputs_label')
+            self.features, self.logits = extractor_network(self.inputs_x)
+            self.predictions = tf.argmax(self.logits, axis=1)
+
+            loss = tf.reduce_mean(tf.nn.sparse_softmax_cross_entropy_with_logits(logits=self.logits,
+                                                                                 labels=self.inputs_label))
+            self.train_op = tf.train.AdamOptimizer(1e-3).minimize(loss)
+            init_op = tf.global_variables_initializer()
+            self.weights = tf.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES, scope='extractor')
+            self.saver = tf.train.Saver(var_list=tf.get_collection(tf.GraphKeys.GLOBAL_VARIABLES, scope='extractor'))
+        self.graph.finalize()
+
+        self.sess = tf.Session(graph=self.graph, config=sess_config)
+        if os.path.isdir(self.model_dir):
+            self.saver.restore(self.sess, os.path.join(self.model_dir, 'model'))
+        elif mnist is None:
+            raise ValueError('no cached extractor in {:s}, a dataset to train it on is needed'.format(self.model_dir))
+        else:
+            self.sess.run(init_op)
+            self.train(mnist, n_epochs)
+
+        # identifies the weights statistics were computed with: a retrained extractor invalidates them
+        self.fingerprint = self.weights_fingerprint()
+
+    def weights_fingerprint(self):
+        digest = hashlib.sha1('v{:d}'.format(extractor_version).encode())
+        for value in self.sess.run(self.weights):
+            digest.update(np.ascontiguousarray(value).tobytes())
+        return digest.hexdigest()
+
+    @staticmethod
+    def rescale(images_u8):
+        # [n, 784] uint8 ==> [n, 28, 28, 1] in -1 ~ 1, like the generator's output
+        return np.reshape(images_u8, (-1, 28, 28, 1)) * np.float32(2.0 / 255.0) - np.float32(1.0)
+
+    def train(self, mnist, n_epochs):
+        # own permutation: the trainer's loader cursor and the global RNG stay untouched
+        rng = np.random.RandomState(0)
+        images_u8, labels_u8 = mnist.train.images_u8, mnist.train.labels_u8
+        n_batches = images_u8.shape[0] // self.batch_size
+        for _ in range(n_epochs):
+            perm = rng.permutation(images_u8.shape[0])
+            for ii in range(n_batches):
+                indices = np.sort(perm[ii * self.batch_size:(ii + 1) * self.batch_size])
+                fd = {self.inputs_x: self.rescale(images_u8[indices]), self.inputs_label: labels_u8[indices]}
+                self.sess.run(self.train_op, feed_dict=fd)
+
+        predictions = self.predict(self.rescale(mnist.test.images_u8))
+        accuracy = np.mean(predictions == mnist.test.labels_u8)
+        print('Feature extractor test accuracy: {:.4f}'.format(accuracy))
+
+        # save next to the final directory and rename: concurrent trainers never see a partial model
+        tmp_dir = '{:s}.{:d}.tmp'.format(self.model_dir, os.getpid())
+        os.makedirs(tmp_dir, exist_ok=True)
+        self.saver.save(self.sess, os.path.join(tmp_dir, 'model'), write_meta_graph=False)
+        try:
+            os.rename(tmp_dir, self.model_dir)
+        except OSError:
+            # another process finished first: use its weights, multithreaded training is not bit reproducible
+            # and every run has to see the same extractor (and fingerprint)
+            shutil.rmtree(tmp_dir)
+            self.saver.restore(self.sess, os.path.join(self.model_dir, 'model'))
+
+    def run(self, fetch, images):
+        # fetch: one tensor or a list of tensors, evaluated 1000 images at a time
+        results = [self.sess.run(fetch, feed_dict={self.inputs_x: images[start:start + 1000]})
+                   for start in range(0, images.shape[0], 1000)]
+        if isinstance(fetch, list):
+            return [np.concatenate(values) for values in zip(*results)]
+        return np.concatenate(results)
+
+    def extract(self, images):
+        return self.run(self.features, images)
+
+    def predict(self, images):
+        return self.run(self.predictions, images)
+
+    def extract_and_predict(self, images):
+        return self.run([self.features, self.predictions], images)
+
+    def close(self):
+        self.sess.close()
+
+
+def feature_stats(features):
+    features = features.astype(np.float64)
+    return np.mean(features, axis=0), np.cov(features, rowvar=False)
+
+
+def frechet_distance(mu1, sigma1, mu2, sigma2):
+    # |mu1 - mu2|^2 + tr(sigma1 + sigma2 - 2 sqrt(sigma1 sigma2)), with tr(sqrt(sigma1 sigma2)) from the
+    # eigenvalues of the symmetric sqrt(sigma1) sigma2 sqrt(sigma1)
+    w, v = np.linalg.eigh(sigma1)
+    sqrt_sigma1 = np.dot(v * np.sqrt(np.clip(w, 0.0, None)), v.T)
+    eigenvalues = np.linalg.eigvalsh(np.dot(np.dot(sqrt_sigma1, sigma2), sqrt_sigma1))
+    tr_covmean = np.sum(np.sqrt(np.clip(eigenvalues, 0.0, None)))
+    diff = mu1 - mu2
+    return float(np.dot(diff, diff) + np.trace(sigma1) + np.trace(sigma2) - 2.0 * tr_covmean)
+
+
+def kernel_distance(features1, features2, n_subsets=10, subset_size=1000, seed=0):
+    # unbiased MMD^2 with the cubic polynomial kernel (x.y / d + 1)^3, averaged over random subsets
+    rng = np.random.RandomState(seed)
+    d = features1.shape[1]
+    m = min(subset_size, features1.shape[0], features2.shape[0])
+    mmds = []
+    for _ in range(n_subsets):
+        x = features1[rng.choice(features1.shape[0], m, replace=False)].astype(np.float64)
+        y = features2[rng.choice(features2.shape[0], m, replace=False)].astype(np.float64)
+        k_xx = (np.dot(x, x.T) / d + 1.0) ** 3
+        k_yy = (np.dot(y, y.T) / d + 1.0) ** 3
+        k_xy = (np.dot(x, y.T) / d + 1.0) ** 3
+        mmd = ((np.sum(k_xx) - np.trace(k_xx)) + (np.sum(k_yy) - np.trace(k_yy))) / (m * (m - 1)) - \
+            2.0 * np.mean(k_xy)
+        mmds.append(mmd)
+    return float(np.mean(mmds))
+
+
+def confusion_matrix(labels, predictions, n_classes):
+    # rows: requested class, columns: predicted class
+    counts = np.bincount(labels * n_classes + predictions, minlength=n_classes * n_classes)
+    return counts.reshape(n_classes, n_classes)
+
+
+def class_entropy(predictions, n_classes):
+    # entropy of the predicted class histogram over log(n_classes): 1 when every class is equally frequent,
+    # 0 when every sample is of one class
+    p = np.bincount(predictions, minlength=n_classes) / float(predictions.shape[0])
+    p = p[p > 0]
+    return float(-np.sum(p * np.log(p)) / np.log(n_classes))
+
+
+def class_accuracy(generator, classifiers, n_samples=5000, batch_size=500, seed=0):
+    # class balanced samples of a conditional generator, every batch scored by every classifier,
+    # classifiers: name ==> fn(images, one hot y) returning the predicted classes
+    if not generator.y_dim:
+        raise ValueError('Either a conditional generator or no class accuracy')
+    start_time = time.perf_counter()
+
+    labels = np.empty(n_samples, dtype=np.int64)
+    predictions = {name: np.empty(n_samples, dtype=np.int64) for name in classifiers}
+    for start, images, batch_labels in generate_batches(generator, n_samples, batch_size, seed):
+        end = start + images.shape[0]
+        labels[start:end] = batch_labels
+        y = np.eye(generator.y_dim, dtype=np.float32)[batch_labels]
+        for name, classify in classifiers.items():
+            predictions[name][start:end] = classify(images, y)
+
+    result = {'n_samples': n_samples}
+    for name in classifiers:
+        confusion = confusion_matrix(labels, predictions[name], generator.y_dim)
+        result[name] = {
+            'accuracy': float(np.trace(confusion)) / n_samples,
+            'per_class': (np.diag(confusion) / np.maximum(np.sum(confusion, axis=1), 1)).tolist(),
+            'confusion': confusion.tolist(),
+        }
+    result['seconds'] = time.perf_counter() - start_time
+    return result
+
+
+class SessionGenerator(object):
+    # export.FrozenGenerator's interface over the inference generator of a training session
+    def __init__(self, sess, g_sample, inputs_z, inputs_y=None):
+        self.sess = sess
+        self.g_sample = g_sample
+        self.inputs_z = inputs_z
+        self.inputs_y = inputs_y
+        self.z_dim = int(inputs_z.shape[1])
+        self.y_dim = int(inputs_y.shape[1]) if inputs_y is not None else 0
+
+    def generate(self, z, y=None):
+        fd = {self.inputs_z: z}
+        if y is not None:
+            fd[self.inputs_y] = y
+        return self.sess.run(self.g_sample, feed_dict=fd)
+
+    def classifier(self, sample_classes):
+        # fn(images, y) for class_accuracy from an in-graph prediction on g_sample, the images are fed
+        # in place of g_sample so they are not generated a second time
+        def classify(images, y):
+            return self.sess.run(sample_classes, feed_dict={self.g_sample: images, self.inputs_y: y})
+        return classify
+
+
+def generate_batches(generator, n_samples, batch_size, seed):
+    # fixed seed: the same noise (and class balanced labels) at every evaluation
+    rng = np.random.RandomState(seed)
+    for start in range(0, n_samples, batch_size):
+        n = min(batch_size, n_samples - start)
+        z = rng.uniform(-1, 1, size=(n, generator.z_dim)).astype(np.float32)
+        labels, y = None, None
+        if generator.y_dim:
+            labels = np.arange(start, start + n) % generator.y_dim
+            y = np.eye(generator.y_dim, dtype=np.float32)[labels]
+        yield start, generator.generate(z, y), labels
+
+
+class StatsCache(object):
+    # real data feature statistics, one directory per (dataset, extractor version, split) under cache_dir:
+    # mu.npy, sigma.npy and optionally features.npy, opened read-only memory-mapped so every evaluation
+    # (and every process) shares the same pages, plus meta.json with the fingerprint of the extractor's weights
+    def __init__(self, cache_dir, extractor):
+        self.cache_dir = cache_dir
+        self.extractor = extractor
+
+    def stats_dir(self, split):
+        return os.path.join(self.cache_dir, 'stats-v{:d}-{:s}'.format(extractor_version, split))
+
+    def is_valid(self, split, with_features):
+        meta_fn = os.path.join(self.stats_dir(split), 'meta.json')
+        if not os.path.isfile(meta_fn):
+            return False
+        with open(meta_fn) as f:
+            meta = json.load(f)
+        return meta['fingerprint'] == self.extractor.fingerprint and (meta['features'] or not with_features)
+
+    def load(self, split, mnist=None, with_features=True):
+        # returns (mu, sigma, features or None), computed first when missing or made by another extractor
+        stats_dir = self.stats_dir(split)
+        if not self.is_valid(split, with_features):
+            if mnist is None:
+                raise ValueError('no valid statistics in {:s}, a dataset to compute them is needed'.format(stats_dir))
+            self.compute(split, getattr(mnist, split).images_u8, with_features)
+
+        mu = np.load(os.path.join(stats_dir, 'mu.npy'), mmap_mode='r')
+        sigma = np.load(os.path.join(stats_dir, 'sigma.npy'), mmap_mode='r')
+        features = None
+        if with_features:
+            features = np.load(os.path.join(stats_dir, 'features.npy'), mmap_mode='r')
+        return mu, sigma, features
+
+    def compute(self, split, images_u8, with_features, chunk_size=5000):
+        # features are written chunk by chunk into a memory map, the full set is never held in memory twice
+        stats_dir = self.stats_dir(split)
+        tmp_dir = '{:s}.{:d}.tmp'.format(stats_dir, os.getpid())
+        os.makedirs(tmp_dir, exist_ok=True)
+
+        n_features = int(self.extractor.features.shape[1])
+        features = np.lib.format.open_memmap(os.path.join(tmp_dir, 'features.npy'), mode='w+', dtype=np.float32,
+                                             shape=(images_u8.shape[0], n_features))
+        for start in range(0, images_u8.shape[0], chunk_size):
+            chunk = images_u8[start:start + chunk_size]
+            features[start:start + chunk.shape[0]] = self.extractor.extract(FeatureExtractor.rescale(chunk))
+        features.flush()
+
+        mu, sigma = feature_stats(features)
+        np.save(os.path.join(tmp_dir, 'mu.npy'), mu)
+        np.save(os.path.join(tmp_dir, 'sigma.npy'), sigma)
+        del features
+        if not with_features:
+            os.remove(os.path.join(tmp_dir, 'features.npy'))
+
+        meta = {
+            'fingerprint': self.extractor.fingerprint,
+            'extractor_version': extractor_version,
+            'split': split,
+            'n_images': int(images_u8.shape[0]),
+            'features': with_features,
+        }
+        with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+            json.dump(meta, f, indent=2)
+
+        # another process finished first with the same extractor: its statistics stay, nothing is swapped
+        if self.is_valid(split, with_features):
+            shutil.rmtree(tmp_dir)
+            return
+
+        # swap the complete directory in, files are never mixed. only a stale directory is moved away first,
+        # a valid one is never missing for a concurrent load()
+        old_dir = None
+        if os.path.isdir(stats_dir):
+            old_dir = '{:s}.{:d}.old'.format(stats_dir, os.getpid())
+            os.rename(stats_dir, old_dir)
+        try:
+            os.rename(tmp_dir, stats_dir)
+        except OSError:
+            # another process swapped its statistics in meanwhile
+            shutil.rmtree(tmp_dir)
+        if old_dir is not None:
+            shutil.rmtree(old_dir)
+
+
+class Evaluator(object):
+    # FID & KID of generator samples against one split of the real data, in the extractor's feature space
+    def __init__(self, dataset_base_dir, mnist_type, mnist=None, sess_config=None, split='test'):
+        self.cache_dir = os.path.join(dataset_base_dir, mnist_type)
+        self.extractor = FeatureExtractor(self.cache_dir, mnist, sess_config)
+        self.stats = StatsCache(self.cache_dir, self.extractor)
+        self.real_mu, self.real_sigma, self.real_features = self.stats.load(split, mnist)
+
+    def evaluate(self, generator, n_samples=10000, batch_size=500, seed=0):
+        start_time = time.perf_counter()
+
+        # samples are streamed through the extractor, only their features and predicted classes are kept
+        features = np.empty((n_samples, self.real_features.shape[1]), dtype=np.float32)
+        predictions = np.empty(n_samples, dtype=np.int64)
+        for start, images, _ in generate_batches(generator, n_samples, batch_size, seed):
+            end = start + images.shape[0]
+            features[start:end], predictions[start:end] = self.extractor.extract_and_predict(images)
+
+        mu, sigma = feature_stats(features)
+        return {
+            'fid': frechet_distance(mu, sigma, self.real_mu, self.real_sigma),
+            'kid': kernel_distance(features, self.real_features),
+            'class_entropy': class_entropy(predictions, int(self.extractor.logits.shape[1])),
+            'n_samples': n_samples,
+            'seconds': time.perf_counter() - start_time,
+        }
+
+    def class_accuracy(self, generator, n_samples=5000, batch_size=500, seed=0, proxies=None):
+        # the cached extractor is the reference classifier, proxies are the model's own (name ==> fn(images, y))
+        classifiers = dict(proxies or {}, classifier=lambda images, y: self.extractor.predict(images))
+        return class_accuracy(generator, classifiers, n_samples, batch_size, seed)
+
+    def close(self):
+        self.extractor.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='FID & KID of the latest checkpoint of a run')
+    parser.add_argument('--model-name', type=str, required=True)
+    parser.add_argument('--mnist-type', type=str, required=True)
+    parser.add_argument('--dataset-base-dir', type=str, default='./data_set')
+    parser.add_argument('--ckpt-dir', type=str, default=None, help='default: ./checkpoints/<model>/<mnist-type>')
+    parser.add_argument('--n-samples', type=int, default=10000)
+    parser.add_argument('--output', type=str, default=None, help='write results as json')
+    args = parser.parse_args()
+
+    ckpt_dir = args.ckpt_dir or './checkpoints/{:s}/{:s}'.format(args.model_name, args.mnist_type)
+    mnist = utils.get_mnist(args.dataset_base_dir, args.mnist_type)
+    evaluator = Evaluator(args.dataset_base_dir, args.mnist_type, mnist)
+    with sample.get_generator(args.model_name, args.mnist_type, ckpt_dir, None) as generator:
+        result = evaluator.evaluate(generator, args.n_samples)
+        if generator.y_dim:
+            result['class_accuracy'] = evaluator.class_accuracy(generator, args.n_samples)
+
+    print('{:s} on {:s}: FID: {:.3f}, KID: {:.5f} ({:d} samples in {:.1f}s)'.format(
+        args.model_name, args.mnist_type, result['fid'], result['kid'], result['n_samples'], result['seconds']))
+    if 'class_accuracy' in result:
+        accuracy = result['class_accuracy']['classifier']
+        print('class accuracy: {:.4f}, per class: {:s}'.format(
+            accuracy['accuracy'], ' '.join('{:.3f}'.format(value) for value in accuracy['per_class'])))
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(dict(result, model=args.model_name, mnist_type=args.mnist_type), f, indent=2)
+    return
+
+
+if __name__ == '__main__':
+    main()
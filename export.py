@@ -0,0 +1,206 @@
+import os
+import json
+import time
+import argparse
+from importlib import import_module
+
+import numpy as np
+import tensorflow as tf
+
+import network
+
+
+# tf.layers.batch_normalization default epsilon and network.generator's leaky relu slope
+bn_epsilon = 1e-3
+alpha = 0.2
+
+# network.generator's layers: (conv2d_transpose, batch_normalization or None, output size, padding)
+conv_layers = [
+    ('conv2d_transpose', 'batch_normalization', 7, 'VALID'),
+    ('conv2d_transpose_1', 'batch_normalization_1', 14, 'SAME'),
+    ('conv2d_transpose_2', None, 28, 'SAME'),
+]
+bn_keys = ['gamma', 'beta', 'moving_mean', 'moving_variance']
+
+
+def read_generator_weights(ckpt_fn):
+    # straight from the checkpoint file: no training graph, no optimizer slots
+    reader = tf.train.NewCheckpointReader(ckpt_fn)
+    names = ['dense/kernel', 'dense/bias']
+    for conv_name, bn_name, _, _ in conv_layers:
+        names += ['{:s}/kernel'.format(conv_name), '{:s}/bias'.format(conv_name)]
+        if bn_name is not None:
+            names += ['{:s}/{:s}'.format(bn_name, key) for key in bn_keys]
+
+    weights = {}
+    for name in names:
+        key = 'generator/{:s}'.format(name)
+        if not reader.has_tensor(key):
+            raise ValueError('"{:s}" is not in {:s}'.format(key, ckpt_fn))
+        weights[name] = reader.get_tensor(key)
+    return weights
+
+
+def fold_batch_norm(kernel, bias, gamma, beta, moving_mean, moving_variance):
+    # bn(conv(x) + b) = conv(x) * s + (b - mean) * s + beta, s = gamma / sqrt(var + eps)
+    # conv2d_transpose kernels are [height, width, out channels, in channels]
+    scale = gamma / np.sqrt(moving_variance + bn_epsilon)
+    folded_kernel = kernel * scale[np.newaxis, np.newaxis, :, np.newaxis]
+    folded_bias = (bias - moving_mean) * scale + beta
+    return folded_kernel.astype(np.float32), folded_bias.astype(np.float32)
+
+
+def folded_generator(weights, z, y=None):
+    # network.generator in inference mode with every batch norm folded into its conv2d_transpose,
+    # all weights are constants
+    inputs = tf.concat([z, y], axis=1) if y is not None else z
+    batch_size = tf.shape(inputs)[0]
+
+    layer = tf.nn.bias_add(tf.matmul(inputs, weights['dense/kernel']), weights['dense/bias'])
+    layer = tf.reshape(layer, shape=[-1, 3, 3, weights['dense/kernel'].shape[1] // 9])
+    layer = tf.maximum(alpha * layer, layer)
+
+    for conv_name, bn_name, size, padding in conv_layers:
+        kernel = weights['{:s}/kernel'.format(conv_name)]
+        bias = weights['{:s}/bias'.format(conv_name)]
+        if bn_name is not None:
+            bn = [weights['{:s}/{:s}'.format(bn_name, key)] for key in bn_keys]
+            kernel, bias = fold_batch_norm(kernel, bias, *bn)
+
+        output_shape = tf.stack([batch_size, size, size, kernel.shape[2]])
+        layer = tf.nn.conv2d_transpose(layer, kernel, output_shape, strides=[1, 2, 2, 1], padding=padding)
+        layer = tf.nn.bias_add(layer, bias)
+        if bn_name is not None:
+            layer = tf.maximum(alpha * layer, layer)
+
+    return tf.tanh(layer, name='images')
+
+
+def export_generator(ckpt_fn, export_dir, model_name, dataset_type, z_dim=100):
+    weights = read_generator_weights(ckpt_fn)
+    model_class = getattr(import_module(model_name), model_name.upper())
+    y_dim = weights['dense/kernel'].shape[0] - z_dim if model_class.conditional else 0
+
+    with tf.Graph().as_default() as graph:
+        z = tf.placeholder(tf.float32, [None, z_dim], name='z')
+        y = tf.placeholder(tf.float32, [None, y_dim], name='y') if y_dim else None
+        folded_generator(weights, z, y)
+
+        # only what the output needs
+        graph_def = tf.graph_util.extract_sub_graph(graph.as_graph_def(), ['images'])
+
+    os.makedirs(export_dir, exist_ok=True)
+    with open(os.path.join(export_dir, 'generator.pb'), 'wb') as f:
+        f.write(graph_def.SerializeToString())
+
+    meta = {
+        'model': model_name,
+        'dataset_type': dataset_type,
+        'checkpoint': os.path.basename(ckpt_fn),
+        'z_dim': z_dim,
+        'y_dim': y_dim,
+    }
+    with open(os.path.join(export_dir, 'generator.json'), 'w') as f:
+        json.dump(meta, f, indent=2)
+    return meta
+
+
+class FrozenGenerator(object):
+    # loads an exported generator: one graph of constants, nothing to restore, no discriminator or optimizer
+    def __init__(self, export_dir, sess_config=None):
+        with open(os.path.join(export_dir, 'generator.json')) as f:
+            self.meta = json.load(f)
+        self.z_dim = self.meta['z_dim']
+        self.y_dim = self.meta['y_dim']
+
+        graph_def = tf.GraphDef()
+        with open(os.path.join(export_dir, 'generator.pb'), 'rb') as f:
+            graph_def.ParseFromString(f.read())
+
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            tf.import_graph_def(graph_def, name='')
+        self.graph.finalize()
+
+        self.inputs_z = self.graph.get_tensor_by_name('z:0')
+        self.inputs_y = self.graph.get_tensor_by_name('y:0') if self.y_dim else None
+        self.images = self.graph.get_tensor_by_name('images:0')
+        self.sess = tf.Session(graph=self.graph, config=sess_config)
+
+    def generate(self, z, y=None):
+        # z: [batch size, z_dim] in -1 ~ 1, y: [batch size, y_dim] one hot ==> images in -1 ~ 1
+        if (y is None) != (self.inputs_y is None):
+            raise ValueError('Either conditional with "y" or unconditional without')
+
+        fd = {self.inputs_z: z}
+        if y is not None:
+            fd[self.inputs_y] = y
+        return self.sess.run(self.images, feed_dict=fd)
+
+    def close(self):
+        self.sess.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+        return False
+
+
+def check_export(ckpt_fn, export_dir, n_samples=64):
+    # folded constants vs network.generator restored from the checkpoint, on the same inputs
+    with FrozenGenerator(export_dir) as frozen:
+        rng = np.random.RandomState(0)
+        z = rng.uniform(-1, 1, size=(n_samples, frozen.z_dim)).astype(np.float32)
+        y = np.eye(frozen.y_dim, dtype=np.float32)[np.arange(n_samples) % frozen.y_dim] if frozen.y_dim else None
+
+        start_time = time.perf_counter()
+        images = frozen.generate(z, y)
+        first_call_time = time.perf_counter() - start_time
+
+    with tf.Graph().as_default():
+        inputs_z = tf.placeholder(tf.float32, [None, z.shape[1]])
+        inputs_y = tf.placeholder(tf.float32, [None, y.shape[1]]) if y is not None else None
+        g_sample = network.generator(inputs_z, y=inputs_y, reuse=False, is_training=False)
+        saver = tf.train.Saver(var_list=tf.get_collection(tf.GraphKeys.GLOBAL_VARIABLES, scope='generator'))
+
+        with tf.Session() as sess:
+            saver.restore(sess, ckpt_fn)
+            fd = {inputs_z: z}
+            if y is not None:
+                fd[inputs_y] = y
+            expected = sess.run(g_sample, feed_dict=fd)
+
+    max_diff = float(np.max(np.abs(images - expected)))
+    print('max abs difference to the checkpoint generator: {:.2e}, first call: {:.3f}s'.format(
+        max_diff, first_call_time))
+    return max_diff
+
+
+def main():
+    parser = argparse.ArgumentParser(description='export a frozen, batch norm folded generator from a checkpoint')
+    parser.add_argument('--model-name', type=str, required=True)
+    parser.add_argument('--mnist-type', type=str, required=True)
+    parser.add_argument('--ckpt-dir', type=str, default=None, help='default: ./checkpoints/<model>/<mnist-type>')
+    parser.add_argument('--export-dir', type=str, default=None, help='default: the checkpoint directory')
+    parser.add_argument('--z-dim', type=int, default=100)
+    parser.add_argument('--check', action='store_true', help='compare against the checkpoint generator')
+    args = parser.parse_args()
+
+    ckpt_dir = args.ckpt_dir or './checkpoints/{:s}/{:s}'.format(args.model_name, args.mnist_type)
+    export_dir = args.export_dir or ckpt_dir
+    ckpt_fn = tf.train.latest_checkpoint(ckpt_dir)
+    if ckpt_fn is None:
+        raise ValueError('no checkpoint in {:s}'.format(ckpt_dir))
+
+    meta = export_generator(ckpt_fn, export_dir, args.model_name, args.mnist_type, args.z_dim)
+    print('Exported {:s} generator from {:s} to {:s}'.format(meta['model'], meta['checkpoint'], export_dir))
+
+    if args.check:
+        check_export(ckpt_fn, export_dir)
+    return
+
+
+if __name__ == '__main__':
+    main()
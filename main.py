@@ -1,33 +1,161 @@
+import os
+import sys
 import json
+import time
+import argparse
+import traceback
+import multiprocessing
 from pprint import pprint
 from importlib import import_module
 
 import utils
 
 
+def parse_args():
+    parser = argparse.ArgumentParser(description='train every entry in params.json')
+    parser.add_argument('--params', type=str, default='params.json', help='json file with training entries')
+    parser.add_argument('--dataset-base-dir', type=str, default='./data_set')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of concurrent trainers (1: train sequentially in this process)')
+    parser.add_argument('--intra-op-threads', type=int, default=None,
+                        help='threads used inside a single op per trainer (default: cpu count / workers)')
+    parser.add_argument('--inter-op-threads', type=int, default=None,
+                        help='ops executed concurrently per trainer (default: 2 with workers > 1)')
+    return parser.parse_args()
+
+
+def get_thread_limits(workers, intra_op_threads, inter_op_threads):
+    # when several trainers share the box, split the cores between them instead of letting
+    # every session spawn one thread per core
+    if workers > 1:
+        if intra_op_threads is None:
+            intra_op_threads = max(1, multiprocessing.cpu_count() // workers)
+        if inter_op_threads is None:
+            inter_op_threads = 2
+
+    # 0 means "let tensorflow decide"
+    return intra_op_threads or 0, inter_op_threads or 0
+
+
+def get_session_config(intra_op_threads, inter_op_threads):
+    import tensorflow as tf
+
+    return tf.ConfigProto(intra_op_parallelism_threads=intra_op_threads,
+                          inter_op_parallelism_threads=inter_op_threads)
+
+
+def get_options(param):
+    # any other key of a params.json entry is passed on to the model, e.g. "fused-step": true ==> fused_step=True
+    return {key.replace('-', '_'): value for key, value in param.items()
+            if key not in ('model-name', 'mnist-type', 'epochs')}
+
+
+def train_single(param, dataset_base_dir, intra_op_threads, inter_op_threads):
+    model_name = param["model-name"]
+    # epochs may be left out when another budget ("max-g-steps", "max-minutes") is given
+    epochs = int(param.get("epochs") or 0)
+    mnist_type = param["mnist-type"]
+    mnist = utils.get_mnist(dataset_base_dir, mnist_type)
+
+    print('Training {:s} with epochs: {:d}, dataset: {:s}'.format(model_name, epochs, mnist_type))
+
+    # get appropriate module and it's class to start training
+    module_name = import_module(model_name)
+    gan_class = getattr(module_name, model_name.upper())
+    sess_config = get_session_config(intra_op_threads, inter_op_threads)
+    net = gan_class(model_name, mnist_type, mnist, epochs, sess_config=sess_config, dataset_base_dir=dataset_base_dir,
+                    **get_options(param))
+    net.train()
+    return
+
+
+def run_worker(job):
+    index, param, dataset_base_dir, intra_op_threads, inter_op_threads = job
+    model_name = param["model-name"]
+    mnist_type = param["mnist-type"]
+
+    # keep each run's output in its own log file under the model's assets directory, appended to across restarts
+    log_dir = './assets/{:s}'.format(model_name)
+    os.makedirs(log_dir, exist_ok=True)
+    log_fn = os.path.join(log_dir, '{:d}-{:s}-train.log'.format(index, mnist_type))
+    with open(log_fn, 'a') as log_file:
+        # redirect file descriptors too, so native tensorflow logs end up in the same file
+        os.dup2(log_file.fileno(), sys.stdout.fileno())
+        os.dup2(log_file.fileno(), sys.stderr.fileno())
+
+        status = 'done'
+        start_time = time.time()
+        try:
+            train_single(param, dataset_base_dir, intra_op_threads, inter_op_threads)
+        except Exception:
+            traceback.print_exc()
+            status = 'failed'
+        elapsed_time = time.time() - start_time
+
+        sys.stdout.flush()
+        sys.stderr.flush()
+    return index, model_name, mnist_type, elapsed_time, status, log_fn
+
+
+def print_summary(results, total_time):
+    print('--summary--')
+    print('{:<10s} {:<16s} {:>12s}  {:<8s} {:s}'.format('model', 'dataset', 'wall time', 'status', 'log'))
+    for _, model_name, mnist_type, elapsed_time, status, log_fn in sorted(results):
+        print('{:<10s} {:<16s} {:>11.1f}s  {:<8s} {:s}'.format(model_name, mnist_type, elapsed_time, status, log_fn))
+    print('total wall time: {:.1f}s'.format(total_time))
+
+
 def main():
+    args = parse_args()
+
     # get training parameters
-    with open('params.json') as f:
+    with open(args.params) as f:
         gan_params = json.load(f)
 
     print('--params--')
     pprint(gan_params)
 
-    dataset_base_dir = './data_set'
-    for param in gan_params:
-        model_name = param["model-name"]
-        epochs = int(param["epochs"])
-        mnist_type = param["mnist-type"]
-        mnist = utils.get_mnist(dataset_base_dir, mnist_type)
+    intra_op_threads, inter_op_threads = get_thread_limits(args.workers, args.intra_op_threads, args.inter_op_threads)
+    jobs = [(index, param, args.dataset_base_dir, intra_op_threads, inter_op_threads)
+            for index, param in enumerate(gan_params)]
+
+    start_time = time.time()
+    results = []
+    if args.workers > 1:
+        # decode every dataset once up front, workers then only memory-map the cached arrays
+        for mnist_type in sorted(set(param["mnist-type"] for param in gan_params)):
+            utils.get_mnist(args.dataset_base_dir, mnist_type)
+
+        # likewise the evaluation classifier and real data statistics, trained and computed once for every worker
+        eval_types = sorted(set(param["mnist-type"] for param in gan_params
+                                if param.get("eval-every") or param.get("accuracy-every")))
+        if eval_types:
+            import evaluation
 
-        print('Training {:s} with epochs: {:d}, dataset: {:s}'.format(model_name, epochs, mnist_type))
+            sess_config = get_session_config(0, 0)
+            for mnist_type in eval_types:
+                mnist = utils.get_mnist(args.dataset_base_dir, mnist_type)
+                evaluation.Evaluator(args.dataset_base_dir, mnist_type, mnist, sess_config).close()
 
-        # get appropriate module and it's class to start training
-        module_name = import_module(model_name)
-        gan_class = getattr(module_name, model_name.upper())
-        net = gan_class(model_name, mnist_type, mnist, epochs)
-        net.train()
+        # tensorflow is not fork safe: start every trainer in a fresh interpreter and
+        # never reuse a worker for a second run
+        context = multiprocessing.get_context('spawn')
+        pool = context.Pool(processes=args.workers, maxtasksperchild=1)
+        try:
+            for result in pool.imap_unordered(run_worker, jobs):
+                _, model_name, mnist_type, elapsed_time, status, _ = result
+                print('Finished {:s} on {:s}: {:s} in {:.1f}s'.format(model_name, mnist_type, status, elapsed_time))
+                results.append(result)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for index, param, dataset_base_dir, _, _ in jobs:
+            run_start_time = time.time()
+            train_single(param, dataset_base_dir, intra_op_threads, inter_op_threads)
+            results.append((index, param["model-name"], param["mnist-type"], time.time() - run_start_time, 'done', '-'))
 
+    print_summary(results, time.time() - start_time)
     return
 
 
@@ -1,8 +1,29 @@
 import tensorflow as tf
 
 
-def generator(z, y=None, reuse=False, is_training=True):
-    with tf.variable_scope('generator', reuse=reuse):
+# reduced precision: layers compute in `dtype` (bfloat16), but every variable is stored in float32 and cast on
+# read, so the optimizer updates float32 master weights and checkpoints stay float32. bfloat16 keeps float32's
+# exponent range, gradients do not underflow and no loss scaling is needed (float16 would need it)
+def float32_master_getter(getter, *args, **kwargs):
+    dtype = kwargs.get('dtype')
+    if dtype is None or dtype == tf.float32:
+        return getter(*args, **kwargs)
+    var = getter(*args, **dict(kwargs, dtype=tf.float32))
+    return tf.cast(var, dtype)
+
+
+def custom_getter(dtype):
+    return float32_master_getter if dtype != tf.float32 else None
+
+
+# batch norm statistics are always computed in float32, bfloat16's 8 bit mantissa is too coarse for them
+def batch_norm(x, is_training):
+    out = tf.layers.batch_normalization(tf.cast(x, tf.float32), training=is_training)
+    return tf.cast(out, x.dtype)
+
+
+def generator(z, y=None, reuse=False, is_training=True, dtype=tf.float32):
+    with tf.variable_scope('generator', reuse=reuse, custom_getter=custom_getter(dtype)):
         alpha = 0.2
         n_filter = 512
         n_kernel = 4
@@ -14,6 +35,7 @@ def generator(z, y=None, reuse=False, is_training=True):
             inputs = tf.concat([z, y], axis=1)
         else:
             inputs = z
+        inputs = tf.cast(inputs, dtype)
 
         # 1. reshape z-vector to fit as 2d shape image with fully connected layer
         l1 = tf.layers.dense(inputs, units=3 * 3 * n_filter, kernel_initializer=w_init)
@@ -23,24 +45,24 @@ def generator(z, y=None, reuse=False, is_training=True):
         # 2. layer2 - [batch size, 3, 3, 512] ==> [batch size, 7, 7, 512]
         l2 = tf.layers.conv2d_transpose(l1, filters=n_filter // 2, kernel_size=3, strides=2, padding='valid',
                                         kernel_initializer=w_init)
-        l2 = tf.layers.batch_normalization(l2, training=is_training)
+        l2 = batch_norm(l2, is_training)
         l2 = tf.maximum(alpha * l2, l2)
 
         # 3. layer3 - [batch size, 7, 7, 256] ==> [batch size, 14, 14, 128]
         l3 = tf.layers.conv2d_transpose(l2, filters=n_filter // 4, kernel_size=n_kernel, strides=2, padding='same',
                                         kernel_initializer=w_init)
-        l3 = tf.layers.batch_normalization(l3, training=is_training)
+        l3 = batch_norm(l3, is_training)
         l3 = tf.maximum(alpha * l3, l3)
 
         # 4. layer4 - [batch size, 14, 14, 128] ==> [batch size, 28, 28, 1]
         l4 = tf.layers.conv2d_transpose(l3, filters=1, kernel_size=n_kernel, strides=2, padding='same',
                                         kernel_initializer=w_init)
-        out = tf.tanh(l4)
+        out = tf.tanh(tf.cast(l4, tf.float32))
         return out
 
 
-def discriminator(x, y=None, reuse=False, is_training=True):
-    with tf.variable_scope('discriminator', reuse=reuse):
+def discriminator(x, y=None, reuse=False, is_training=True, dtype=tf.float32):
+    with tf.variable_scope('discriminator', reuse=reuse, custom_getter=custom_getter(dtype)):
         alpha = 0.2
         n_filter = 64
         n_kernel = 4
@@ -56,6 +78,7 @@ def discriminator(x, y=None, reuse=False, is_training=True):
             inputs = tf.concat([x, y_tiled], axis=3)
         else:
             inputs = x
+        inputs = tf.cast(inputs, dtype)
 
         # 1. layer 1 - [batch size, 28, 28, 1] ==> [batch size, 14, 14, 64]
         l1 = tf.layers.conv2d(inputs, filters=n_filter, kernel_size=n_kernel, strides=2, padding='same',
@@ -65,35 +88,35 @@ def discriminator(x, y=None, reuse=False, is_training=True):
         # 2. layer 2 - [batch size, 14, 14, 64] ==> [batch size, 7, 7, 128]
         l2 = tf.layers.conv2d(l1, filters=n_filter * 2, kernel_size=n_kernel, strides=2, padding='same',
                               kernel_initializer=w_init)
-        l2 = tf.layers.batch_normalization(l2, training=is_training)
+        l2 = batch_norm(l2, is_training)
         l2 = tf.maximum(alpha * l2, l2)
 
         # 3. layer 3 - [batch size, 7, 7, 128] ==> [batch size, 4, 4, 256]
         l3 = tf.layers.conv2d(l2, filters=n_filter * 4, kernel_size=n_kernel, strides=2, padding='same',
                               kernel_initializer=w_init)
-        l3 = tf.layers.batch_normalization(l3, training=is_training)
+        l3 = batch_norm(l3, is_training)
         l3 = tf.maximum(alpha * l3, l3)
 
         # 4. flatten layer & fully connected layer
         # l4 = tf.reshape(l3, shape=[-1, 4 * 4 * 256])
         l4 = tf.contrib.layers.flatten(l3)
 
-        # final logits
+        # final logits, losses are computed in float32
         logits = tf.layers.dense(l4, units=1, kernel_initializer=w_init)
 
-        return logits, l4
+        return tf.cast(logits, tf.float32), tf.cast(l4, tf.float32)
 
 
-def classifier(x, out_dim, reuse=False, is_training=True):
-    with tf.variable_scope("classifier", reuse=reuse):
+def classifier(x, out_dim, reuse=False, is_training=True, dtype=tf.float32):
+    with tf.variable_scope("classifier", reuse=reuse, custom_getter=custom_getter(dtype)):
         alpha = 0.2
 
         # 1. layer 1 - fully connected layer
-        l1 = tf.layers.dense(x, 128)
-        l1 = tf.layers.batch_normalization(l1, training=is_training)
+        l1 = tf.layers.dense(tf.cast(x, dtype), 128)
+        l1 = batch_norm(l1, is_training)
         l1 = tf.maximum(alpha * l1, l1)
 
         # final logits
         logits = tf.layers.dense(l1, out_dim)
 
-        return logits
+        return tf.cast(logits, tf.float32)
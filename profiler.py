@@ -0,0 +1,125 @@
+import os
+import csv
+import json
+import time
+import collections
+import numpy as np
+import tensorflow as tf
+from tensorflow.python.client import timeline
+
+
+class _NullPhase(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        return False
+
+
+class NullProfiler(object):
+    # stands in for StepProfiler when profiling is off: phases cost one attribute lookup and an empty with-block
+    _null_phase = _NullPhase()
+
+    def phase(self, name):
+        return self._null_phase
+
+    def export(self, fn_prefix):
+        return
+
+
+class _Phase(object):
+    def __init__(self, durations):
+        self.durations = durations
+        self.start_time = None
+
+    def __enter__(self):
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.durations.append(time.perf_counter() - self.start_time)
+        return False
+
+
+class StepProfiler(object):
+    # wall time of every training phase (data fetch, feed preparation, updates, logging, sampling, ...)
+    # exported as percentiles and histograms, in milliseconds
+    def __init__(self, n_bins=20):
+        self.n_bins = n_bins
+        self.durations = collections.OrderedDict()
+
+    def phase(self, name):
+        if name not in self.durations:
+            self.durations[name] = []
+        return _Phase(self.durations[name])
+
+    def histogram(self, durations_ms):
+        # log spaced bins: step times are heavy tailed
+        low, high = max(np.min(durations_ms), 1e-3), max(np.max(durations_ms), 1e-3)
+        edges = np.geomspace(low, high * (1.0 + 1e-6), self.n_bins + 1)
+        counts, edges = np.histogram(np.clip(durations_ms, low, None), bins=edges)
+        return {'edges_ms': edges.tolist(), 'counts': counts.tolist()}
+
+    def summary(self):
+        summary = collections.OrderedDict()
+        for name, durations in self.durations.items():
+            if not durations:
+                continue
+
+            durations_ms = np.array(durations) * 1000.0
+            summary[name] = collections.OrderedDict([
+                ('count', len(durations)),
+                ('total_s', float(np.sum(durations))),
+                ('mean_ms', float(np.mean(durations_ms))),
+                ('p50_ms', float(np.percentile(durations_ms, 50))),
+                ('p90_ms', float(np.percentile(durations_ms, 90))),
+                ('p99_ms', float(np.percentile(durations_ms, 99))),
+                ('max_ms', float(np.max(durations_ms))),
+                ('histogram', self.histogram(durations_ms)),
+            ])
+        return summary
+
+    def export(self, fn_prefix):
+        summary = self.summary()
+
+        with open('{:s}.json'.format(fn_prefix), 'w') as f:
+            json.dump(summary, f, indent=2)
+
+        columns = ['count', 'total_s', 'mean_ms', 'p50_ms', 'p90_ms', 'p99_ms', 'max_ms']
+        with open('{:s}.csv'.format(fn_prefix), 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['phase'] + columns)
+            for name, stats in summary.items():
+                writer.writerow([name] + [stats[column] for column in columns])
+
+        # short report in the training log
+        for name, stats in summary.items():
+            print('{:<24s} n: {:7d}, total: {:9.2f}s, p50: {:8.3f}ms, p90: {:8.3f}ms, p99: {:8.3f}ms'.format(
+                name, stats['count'], stats['total_s'], stats['p50_ms'], stats['p90_ms'], stats['p99_ms']))
+        return
+
+
+class Tracer(object):
+    # chrome://tracing timelines (RunOptions/RunMetadata full traces) of the session calls of a window of steps
+    def __init__(self, trace_dir, prefix, first_step, n_steps=5):
+        self.trace_dir = trace_dir
+        self.prefix = prefix
+        self.first_step = first_step
+        self.n_steps = n_steps
+        os.makedirs(self.trace_dir, exist_ok=True)
+
+        # one options proto for every traced call
+        self.run_options = tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE)
+
+    def active(self, step):
+        return self.first_step <= step < self.first_step + self.n_steps
+
+    def run(self, sess, fetches, feed_dict, name):
+        run_metadata = tf.RunMetadata()
+        results = sess.run(fetches, feed_dict=feed_dict, options=self.run_options, run_metadata=run_metadata)
+
+        trace = timeline.Timeline(run_metadata.step_stats)
+        trace_fn = os.path.join(self.trace_dir, '{:s}-{:s}.json'.format(self.prefix, name))
+        with open(trace_fn, 'w') as f:
+            f.write(trace.generate_chrome_trace_format())
+        return results
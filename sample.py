@@ -0,0 +1,194 @@
+import os
+import json
+import time
+import argparse
+
+import numpy as np
+import tensorflow as tf
+
+import utils
+import export
+
+
+def get_generator(model_name, mnist_type, ckpt_dir, sess_config):
+    # the frozen generator of the latest checkpoint, exported again when the checkpoint is newer
+    ckpt_fn = tf.train.latest_checkpoint(ckpt_dir)
+    if ckpt_fn is None:
+        raise ValueError('no checkpoint in {:s}'.format(ckpt_dir))
+
+    meta_fn = os.path.join(ckpt_dir, 'generator.json')
+    meta = None
+    if os.path.isfile(meta_fn):
+        with open(meta_fn) as f:
+            meta = json.load(f)
+    if meta is None or meta['checkpoint'] != os.path.basename(ckpt_fn):
+        export.export_generator(ckpt_fn, ckpt_dir, model_name, mnist_type)
+    return export.FrozenGenerator(ckpt_dir, sess_config)
+
+
+def to_uint8(images):
+    # [n, 28, 28, 1] in -1 ~ 1 ==> [n, 28, 28] uint8, same mapping as the validation grids
+    out = np.empty(images.shape[:3], dtype=np.uint8)
+    np.copyto(out, (images[..., 0] + 1.0) * 127.5, casting='unsafe')
+    return out
+
+
+class NpzWriter(object):
+    # compressed shards of `shard_size` images (and labels), written on the asset writer thread
+    def __init__(self, output_dir, n_images, shard_size, asset_writer):
+        self.output_dir = output_dir
+        self.shard_size = shard_size
+        self.asset_writer = asset_writer
+        self.images = []
+        self.labels = []
+        self.n_pending = 0
+        self.n_shards = 0
+
+    def write(self, start, images, labels):
+        # batches are split at shard boundaries
+        while images.shape[0] > 0:
+            n = min(self.shard_size - self.n_pending, images.shape[0])
+            self.images.append(images[:n])
+            self.labels.append(labels[:n] if labels is not None else None)
+            self.n_pending += n
+            images = images[n:]
+            labels = labels[n:] if labels is not None else None
+
+            if self.n_pending == self.shard_size:
+                self.flush()
+
+    def flush(self):
+        if self.n_pending == 0:
+            return
+
+        shard_fn = os.path.join(self.output_dir, 'shard-{:05d}.npz'.format(self.n_shards))
+        arrays = {'images': np.concatenate(self.images)}
+        if self.labels[0] is not None:
+            arrays['labels'] = np.concatenate(self.labels)
+        self.asset_writer.submit(np.savez_compressed, shard_fn, **arrays)
+
+        self.images, self.labels = [], []
+        self.n_pending = 0
+        self.n_shards += 1
+
+    def close(self):
+        self.flush()
+
+
+class PngWriter(object):
+    # one PNG per image, named by index (and class for conditional models)
+    def __init__(self, output_dir, n_images, shard_size, asset_writer):
+        self.output_dir = output_dir
+        self.asset_writer = asset_writer
+
+    def write(self, start, images, labels):
+        self.asset_writer.submit(self.write_batch, start, images, labels)
+
+    def write_batch(self, start, images, labels):
+        for ii in range(images.shape[0]):
+            if labels is None:
+                image_fn = '{:07d}.png'.format(start + ii)
+            else:
+                image_fn = '{:07d}-c{:d}.png'.format(start + ii, labels[ii])
+            utils.write_png(os.path.join(self.output_dir, image_fn), images[ii])
+
+    def close(self):
+        return
+
+
+class MemmapWriter(object):
+    # images.npy (and labels.npy) written in place: open with np.load(fn, mmap_mode='r')
+    def __init__(self, output_dir, n_images, shard_size, asset_writer):
+        self.images = np.lib.format.open_memmap(os.path.join(output_dir, 'images.npy'), mode='w+',
+                                                dtype=np.uint8, shape=(n_images, 28, 28))
+        self.labels_fn = os.path.join(output_dir, 'labels.npy')
+        self.labels = None
+
+    def write(self, start, images, labels):
+        self.images[start:start + images.shape[0]] = images
+        if labels is not None:
+            if self.labels is None:
+                self.labels = np.lib.format.open_memmap(self.labels_fn, mode='w+', dtype=np.uint8,
+                                                        shape=(self.images.shape[0],))
+            self.labels[start:start + labels.shape[0]] = labels
+
+    def close(self):
+        self.images.flush()
+        if self.labels is not None:
+            self.labels.flush()
+
+
+writers = {'npz': NpzWriter, 'png': PngWriter, 'memmap': MemmapWriter}
+
+
+def generate(generator, writer, n_images, batch_size, seed, class_id=None):
+    # same seed, same images: noise and labels come from one generator seeded once
+    rng = np.random.default_rng(seed)
+    z = np.empty((batch_size, generator.z_dim), dtype=np.float32)
+
+    generation_time = 0.0
+    for start in range(0, n_images, batch_size):
+        n = min(batch_size, n_images - start)
+        rng.random(out=z, dtype=np.float32)
+        batch_z = z[:n] * 2.0 - 1.0
+
+        # class balanced labels: image i is of class i % y_dim, unless a single class is asked for
+        labels, batch_y = None, None
+        if generator.y_dim:
+            if class_id is None:
+                labels = (np.arange(start, start + n) % generator.y_dim).astype(np.uint8)
+            else:
+                labels = np.full(n, class_id, dtype=np.uint8)
+            batch_y = np.eye(generator.y_dim, dtype=np.float32)[labels]
+
+        start_time = time.perf_counter()
+        images = generator.generate(batch_z, batch_y)
+        generation_time += time.perf_counter() - start_time
+
+        writer.write(start, to_uint8(images), labels)
+    return generation_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description='generate a large image set from the latest checkpoint')
+    parser.add_argument('--model-name', type=str, required=True)
+    parser.add_argument('--mnist-type', type=str, required=True)
+    parser.add_argument('--ckpt-dir', type=str, default=None, help='default: ./checkpoints/<model>/<mnist-type>')
+    parser.add_argument('--output-dir', type=str, default=None, help='default: ./samples/<model>/<mnist-type>')
+    parser.add_argument('--n-images', type=int, default=10000)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--format', type=str, default='npz', choices=sorted(writers.keys()))
+    parser.add_argument('--shard-size', type=int, default=10000, help='images per npz shard')
+    parser.add_argument('--class-id', type=int, default=None,
+                        help='conditional models only: generate this class only (default: all classes, balanced)')
+    parser.add_argument('--intra-op-threads', type=int, default=0)
+    parser.add_argument('--inter-op-threads', type=int, default=0)
+    args = parser.parse_args()
+
+    ckpt_dir = args.ckpt_dir or './checkpoints/{:s}/{:s}'.format(args.model_name, args.mnist_type)
+    output_dir = args.output_dir or './samples/{:s}/{:s}'.format(args.model_name, args.mnist_type)
+    os.makedirs(output_dir, exist_ok=True)
+
+    sess_config = tf.ConfigProto(intra_op_parallelism_threads=args.intra_op_threads,
+                                 inter_op_parallelism_threads=args.inter_op_threads)
+
+    start_time = time.perf_counter()
+    with get_generator(args.model_name, args.mnist_type, ckpt_dir, sess_config) as generator:
+        if args.class_id is not None and not (generator.y_dim and 0 <= args.class_id < generator.y_dim):
+            raise ValueError('"class-id" needs a conditional model and 0 <= class-id < {:d}'.format(generator.y_dim))
+
+        # compression and png encoding run on the asset writer thread while the next batch is generated
+        with utils.AssetWriter() as asset_writer:
+            writer = writers[args.format](output_dir, args.n_images, args.shard_size, asset_writer)
+            generation_time = generate(generator, writer, args.n_images, args.batch_size, args.seed, args.class_id)
+            writer.close()
+    elapsed_time = time.perf_counter() - start_time
+
+    print('Generated {:d} images to {:s}: {:.1f} images/s generating, {:.1f} images/s overall'.format(
+        args.n_images, output_dir, args.n_images / generation_time, args.n_images / elapsed_time))
+    return
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,459 @@
+import os
+import numpy as np
+import tensorflow as tf
+import time
+
+import utils
+import dataset
+import network
+import profiler
+import checkpoint
+import evaluation
+import early_stopping
+
+
+class Trainer(object):
+    # everything the models share: inputs, validation sampler, optimizers, fused steps, checkpoints and the
+    # training loop. a model only defines its losses (build_losses) and, when it is not "every update on every
+    # step", its update schedule (n_updates)
+
+    # one label per loss returned by build_losses, in the order the updates are applied
+    loss_labels = ['Discriminator', 'Generator']
+
+    # feed class labels to generator & discriminator
+    conditional = False
+
+    def __init__(self, name, dataset_type, mnist_loader, epochs, sess_config=None, fused_step=False,
+                 input_mode='feed', ckpt_every_epochs=1, ckpt_every_minutes=None, ckpt_keep=3, resume=True,
+                 max_g_steps=None, max_minutes=None, profile=False, trace_first_step=None, trace_steps=5,
+                 eval_every=None, eval_samples=10000, accuracy_every=None, accuracy_samples=5000,
+                 monitor='fid', patience=None, min_improvement=0.0, min_class_entropy=None, precision='float32',
+                 dataset_base_dir='./data_set', output_dir='.'):
+        if not (input_mode == 'feed' or input_mode == 'dataset'):
+            raise ValueError('Either "feed" or "dataset"')
+        if not (precision == 'float32' or precision == 'bfloat16'):
+            raise ValueError('Either "float32" or "bfloat16"')
+        if not (epochs or max_g_steps or max_minutes):
+            raise ValueError('Either "epochs", "max_g_steps" or "max_minutes"')
+        if accuracy_every and not self.conditional:
+            raise ValueError('Either a conditional model or no "accuracy_every"')
+        if (patience or min_class_entropy) and not (eval_every or accuracy_every):
+            raise ValueError('Either "eval_every" or "accuracy_every" with early stopping')
+        if min_class_entropy and not eval_every:
+            raise ValueError('Either "eval_every" or no "min_class_entropy": class entropy comes with FID & KID')
+        # with evaluations on, the best checkpoint follows the monitored metric: it has to be evaluated
+        monitor_every, monitor_option = eval_every, 'eval_every'
+        if monitor == 'class_accuracy':
+            monitor_every, monitor_option = accuracy_every, 'accuracy_every'
+        if (eval_every or accuracy_every) and not monitor_every:
+            raise ValueError('Either "{:s}" or another "monitor" than "{:s}"'.format(monitor_option, monitor))
+
+        # prepare directories
+        self.assets_dir = '{:s}/assets/{:s}'.format(output_dir, name)
+        self.ckpt_dir = '{:s}/checkpoints/{:s}/{:s}'.format(output_dir, name, dataset_type)
+        os.makedirs(self.assets_dir, exist_ok=True)
+        os.makedirs(self.ckpt_dir, exist_ok=True)
+
+        #
+        self.dataset_type = dataset_type
+        self.mnist_loader = mnist_loader
+        self.sess_config = sess_config
+
+        # tunable parameters
+        self.y_dim = 10
+        self.z_dim = 100
+        self.learning_rate = 0.0002
+        self.epochs = epochs
+        self.max_g_steps = max_g_steps
+        self.max_minutes = max_minutes
+        self.batch_size = 128
+        self.print_every = 30
+        self.save_every = 1
+        self.val_block_size = 10
+        self.input_mode = input_mode
+        # networks compute in this type, weights, batch norm, losses and inputs stay float32
+        self.dtype = tf.bfloat16 if precision == 'bfloat16' else tf.float32
+        self.resume = resume
+        self.eval_every = eval_every
+        self.eval_samples = eval_samples
+        self.accuracy_every = accuracy_every
+        self.accuracy_samples = accuracy_samples
+
+        # per phase wall time of every step, exported under assets_dir at the end of training
+        self.profiler = profiler.StepProfiler() if profile else profiler.NullProfiler()
+
+        # timelines of the session calls of steps trace_first_step ~ trace_first_step + trace_steps - 1
+        self.tracer = None
+        if trace_first_step is not None:
+            self.tracer = profiler.Tracer(os.path.join(self.assets_dir, 'traces'), dataset_type,
+                                          trace_first_step, trace_steps)
+
+        # FID & KID every eval_every epochs and class accuracy every accuracy_every epochs, the feature extractor
+        # lives in its own graph and session
+        self.evaluator = None
+        if eval_every or accuracy_every:
+            self.evaluator = evaluation.Evaluator(dataset_base_dir, dataset_type, mnist_loader, sess_config)
+
+        # best value of the monitored metric so far, and when to stop before the budget runs out
+        self.early_stopping = early_stopping.EarlyStopping(monitor, patience, min_improvement, min_class_entropy)
+
+        # a tf.data pipeline hands out a new batch on every session call, so all updates have to share one call
+        self.fused_step = fused_step or input_mode == 'dataset'
+
+        # start building graphs
+        tf.reset_default_graph()
+
+        # create placeholders
+        self.build_inputs()
+
+        # create networks & compute model losses
+        self.losses = self.build_losses(reuse=False)
+
+        # inference generator for validation samples, built once and reused every epoch
+        self.g_sample = network.generator(self.inputs_z, y=self.inputs_y, reuse=True, is_training=False,
+                                          dtype=self.dtype)
+        self.g_sample_classes = self.build_sample_classifier()
+
+        # model optimizer
+        self.train_ops = self.model_opt(self.losses)
+
+        # all updates of a step in a single session call
+        if self.fused_step:
+            self.fused_ops, self.fused_losses = self.fused_opt()
+
+        # profiler phase and trace name of each unfused update
+        self.update_phases = ['{:s} update'.format(label) for label in self.loss_labels]
+        self.update_names = [label.lower() for label in self.loss_labels]
+
+        # names used by the benchmarks and the older scripts
+        self.d_loss, self.g_loss = self.losses[:2]
+        self.d_opt, self.g_opt = self.train_ops[:2]
+
+        # periodic checkpoints, including the training state needed to resume
+        self.checkpointer = checkpoint.Checkpointer(self.ckpt_dir, ckpt_every_epochs, ckpt_every_minutes, ckpt_keep)
+
+        # the checkpoint with the best monitored metric, in its own directory so it is never rotated out
+        self.best_checkpointer = None
+        if self.evaluator is not None:
+            self.best_checkpointer = checkpoint.Checkpointer(os.path.join(self.ckpt_dir, 'best'), None, None, 1)
+        return
+
+    def build_inputs(self):
+        # feed mode batches are prepared in place in float32 buffers, in dataset mode the placeholders
+        # default to the pipeline's batch and can still be fed
+        self.batches = dataset.BatchBuffers(self.mnist_loader.train, self.batch_size, self.z_dim)
+        self.pipeline = None
+        self.inputs_y = None
+        if self.input_mode == 'dataset':
+            self.pipeline = dataset.InputPipeline(self.mnist_loader.train, self.batch_size, self.z_dim)
+            self.inputs_x = tf.placeholder_with_default(self.pipeline.images, [None, 28, 28, 1], name='inputs_x')
+            if self.conditional:
+                self.inputs_y = tf.placeholder_with_default(self.pipeline.labels, [None, self.y_dim], name='inputs_y')
+            self.inputs_z = tf.placeholder_with_default(self.pipeline.noise, [None, self.z_dim], name='inputs_z')
+        else:
+            self.inputs_x = tf.placeholder(tf.float32, [None, 28, 28, 1], name='inputs_x')
+            if self.conditional:
+                self.inputs_y = tf.placeholder(tf.float32, [None, self.y_dim], name='inputs_y')
+            self.inputs_z = tf.placeholder(tf.float32, [None, self.z_dim], name='inputs_z')
+
+    def build_losses(self, reuse):
+        # create the training networks on self.inputs_* and return one loss per update
+        # called again with reuse=True to rebuild the losses of fused steps
+        raise NotImplementedError
+
+    def build_sample_classifier(self):
+        # predicted classes of self.g_sample by the model's own networks, None for models without a classifier
+        return None
+
+    def n_updates(self, step):
+        # how many updates (a prefix of self.train_ops) run at this step
+        return len(self.train_ops)
+
+    def within_budget(self, epoch, g_steps, start_time):
+        # training stops at whichever budget runs out first: data passes, generator updates or wall time
+        # generator updates are the unit of progress, so models with different critic schedules can be
+        # compared at equal budgets
+        if self.epochs and epoch >= self.epochs:
+            return False
+        if self.max_g_steps and g_steps >= self.max_g_steps:
+            return False
+        if self.max_minutes and time.time() - start_time >= self.max_minutes * 60.0:
+            return False
+        return True
+
+    def make_optimizer(self):
+        beta1 = 0.5
+        return tf.train.AdamOptimizer(self.learning_rate, beta1=beta1)
+
+    def var_lists(self):
+        # Get weights and bias to update, one list per loss
+        t_vars = tf.trainable_variables()
+        d_vars = [var for var in t_vars if var.name.startswith('discriminator')]
+        g_vars = [var for var in t_vars if var.name.startswith('generator')]
+        return [d_vars, g_vars]
+
+    def minimize(self, optimizer, loss, var_list):
+        return optimizer.minimize(loss, var_list=var_list)
+
+    def model_opt(self, losses):
+        self.update_vars = self.var_lists()
+
+        # Optimize
+        self.optimizers = [self.make_optimizer() for _ in losses]
+        with tf.control_dependencies(tf.get_collection(tf.GraphKeys.UPDATE_OPS)):
+            train_ops = [self.minimize(optimizer, loss, var_list)
+                         for optimizer, loss, var_list in zip(self.optimizers, losses, self.update_vars)]
+        return train_ops
+
+    def fused_opt(self):
+        # fused_ops[k] runs updates 0..k: update k minimizes a copy of its loss that reads the weights written by
+        # update k-1, so one session call gives the same result as one call per update
+        fused_ops = [self.train_ops[0]]
+        fused_losses = [self.losses[0]]
+        for k in range(1, len(self.losses)):
+            n_update_ops = len(tf.get_collection(tf.GraphKeys.UPDATE_OPS))
+            with utils.run_after([fused_ops[-1]]):
+                loss = self.build_losses(reuse=True)[k]
+
+            # batch norm statistics are updated once per step, by the first update
+            del tf.get_collection_ref(tf.GraphKeys.UPDATE_OPS)[n_update_ops:]
+
+            # same optimizer (and slots) as the unfused update
+            train_op = self.minimize(self.optimizers[k], loss, self.update_vars[k])
+            fused_ops.append(tf.group(fused_ops[-1], train_op))
+            fused_losses.append(loss)
+        return fused_ops, fused_losses
+
+    def next_feed(self):
+        if self.input_mode == 'dataset':
+            return None
+
+        with self.profiler.phase('fetch'):
+            self.batches.fetch()
+
+        # images rescaled to -1 ~ 1 and random noise for G, float32 and reused at every step
+        with self.profiler.phase('feed'):
+            batch_x, batch_y, batch_z = self.batches.prepare()
+
+            fd = {self.inputs_x: batch_x, self.inputs_z: batch_z}
+            if self.conditional:
+                fd[self.inputs_y] = batch_y
+        return fd
+
+    def run(self, sess, fetches, fd, step, name):
+        # traced session call inside the trace window, a plain one otherwise
+        if self.tracer is not None and self.tracer.active(step):
+            return self.tracer.run(sess, fetches, fd, 'step{:06d}-{:s}'.format(step, name))
+        return sess.run(fetches, feed_dict=fd)
+
+    def train_step(self, sess, fd, step):
+        # fetch the losses computed by the updates themselves instead of evaluating them again
+        # losses of updates skipped at this step are None
+        n_updates = self.n_updates(step)
+        if self.fused_step:
+            with self.profiler.phase('fused update'):
+                fetches = [self.fused_ops[n_updates - 1]] + self.fused_losses[:n_updates]
+                values = self.run(sess, fetches, fd, step, 'fused')[1:]
+        else:
+            values = []
+            for k in range(n_updates):
+                with self.profiler.phase(self.update_phases[k]):
+                    fetches = [self.train_ops[k], self.losses[k]]
+                    values.append(self.run(sess, fetches, fd, step, self.update_names[k])[1])
+        return values + [None] * (len(self.losses) - n_updates)
+
+    def validation_samples(self):
+        n_samples = self.val_block_size * self.val_block_size
+        if not self.conditional:
+            return {}
+
+        # the same noise and labels (one row per class) at every epoch
+        fixed_z = np.random.uniform(-1, 1, size=(n_samples, self.z_dim))
+        fixed_y = np.zeros(shape=[n_samples, self.y_dim])
+        for s in range(n_samples):
+            loc = s % self.y_dim
+            fixed_y[s, loc] = 1
+        return {'fixed_z': fixed_z, 'fixed_y': fixed_y}
+
+    def validation_feed(self, samples):
+        if self.conditional:
+            return {self.inputs_z: samples['fixed_z'], self.inputs_y: samples['fixed_y']}
+
+        # fresh noise at every epoch
+        n_samples = self.val_block_size * self.val_block_size
+        return {self.inputs_z: np.random.uniform(-1, 1, size=(n_samples, self.z_dim))}
+
+    def train_state(self, epoch, batch, steps, g_steps, losses, start_time, **extra):
+        state = {
+            'epoch': epoch,
+            'batch': batch,
+            'steps': steps,
+            'g_steps': g_steps,
+            'losses': losses,
+            'elapsed_time': time.time() - start_time,
+            'loader': self.batches.get_state(),
+            'metrics': self.metrics
+        }
+        return dict(state, **extra)
+
+    def evaluate_epoch(self, sess, epoch, g_steps):
+        # quality metrics due after this epoch, None when nothing is due
+        eval_due = self.eval_every and epoch % self.eval_every == 0
+        accuracy_due = self.accuracy_every and epoch % self.accuracy_every == 0
+        if not (eval_due or accuracy_due):
+            return None
+
+        metrics = {'epoch': epoch, 'g_steps': g_steps}
+        generator = evaluation.SessionGenerator(sess, self.g_sample, self.inputs_z, self.inputs_y)
+        with self.profiler.phase('evaluation'):
+            if eval_due:
+                metrics.update(self.evaluator.evaluate(generator, self.eval_samples))
+                print('Epoch {:d} FID: {:.3f}, KID: {:.5f} ({:.1f}s)'.format(
+                    epoch, metrics['fid'], metrics['kid'], metrics['seconds']))
+
+            if accuracy_due:
+                # the pretrained classifier, and the model's own one on the same samples when it has one
+                proxies = {}
+                if self.g_sample_classes is not None:
+                    proxies['auxilary'] = generator.classifier(self.g_sample_classes)
+                result = self.evaluator.class_accuracy(generator, self.accuracy_samples, proxies=proxies)
+                metrics['class_accuracy'] = result
+                for name in ['classifier'] + list(proxies):
+                    print('Epoch {:d} class accuracy ({:s}): {:.4f} ({:.1f}s)'.format(
+                        epoch, name, result[name]['accuracy'], result['seconds']))
+        return metrics
+
+    def train(self):
+        samples = self.validation_samples()
+
+        steps = 0
+        g_steps = 0
+        losses = []
+        self.metrics = []
+        n_batches = self.mnist_loader.train.num_examples // self.batch_size
+
+        start_epoch, start_batch = 0, 0
+        elapsed_time = 0.0
+        last_ckpt_steps = None
+        stop_reason = None
+
+        with tf.Session(config=self.sess_config) as sess, utils.AssetWriter() as asset_writer:
+            # reset tensorflow variables
+            sess.run(tf.global_variables_initializer())
+            if self.pipeline is not None:
+                self.pipeline.initialize(sess)
+
+            # continue from the latest checkpoint of this run, if there is one
+            state = self.checkpointer.restore(sess) if self.resume else None
+            if state is not None:
+                start_epoch, start_batch = state['epoch'], state['batch']
+                steps, g_steps, losses = state['steps'], state['g_steps'], state['losses']
+                self.metrics = state.get('metrics', [])
+                stop_reason = self.early_stopping.replay(self.metrics)
+                elapsed_time = state['elapsed_time']
+                self.batches.set_state(state['loader'])
+                samples = {key: state[key] for key in samples}
+                last_ckpt_steps = steps
+                print('Resuming from epoch {:d}, step {:d}'.format(start_epoch + 1, steps))
+
+            # every op is built by now, adding one during training is a bug
+            sess.graph.finalize()
+            start_time = time.time() - elapsed_time
+
+            # losses of skipped updates are carried over from the last step that ran them
+            train_losses = list(losses[-1]) if losses else [None] * len(self.losses)
+
+            # start training
+            e, ii = start_epoch, start_batch
+            while stop_reason is None and self.within_budget(e, g_steps, start_time):
+                while ii < n_batches and self.within_budget(e, g_steps, start_time):
+                    with self.profiler.phase('step'):
+                        # next batch, rescaled to -1 ~ 1, and noise (nothing to feed in dataset mode)
+                        fd = self.next_feed()
+
+                        # Run optimizers
+                        values = self.train_step(sess, fd, steps)
+
+                        with self.profiler.phase('logging'):
+                            train_losses = [prev if value is None else value
+                                            for value, prev in zip(values, train_losses)]
+                            if values[1] is not None:
+                                g_steps += 1
+
+                            # losses come with the optimizer run, so they are recorded at every step
+                            losses.append(tuple(train_losses))
+
+                            # print losses
+                            if steps % self.print_every == 0:
+                                print("Epoch {}/{}...".format(e + 1, self.epochs or '-'),
+                                      "Generator steps: {}...".format(g_steps),
+                                      "...".join("{:s} Loss: {:.4f}".format(label, value)
+                                                 for label, value in zip(self.loss_labels, train_losses)))
+
+                    steps += 1
+                    ii += 1
+
+                    # checkpoint in the middle of an epoch when enough time has passed
+                    if self.checkpointer.time_due():
+                        with self.profiler.phase('checkpoint'):
+                            state = self.train_state(e, ii, steps, g_steps, losses, start_time, **samples)
+                            self.checkpointer.save(sess, steps, state)
+                        last_ckpt_steps = steps
+
+                # the generator step or time budget ran out in the middle of an epoch
+                if ii < n_batches:
+                    break
+
+                # save generation results at every epochs
+                if e % self.save_every == 0:
+                    with self.profiler.phase('sampling'):
+                        val_out = sess.run(self.g_sample, feed_dict=self.validation_feed(samples))
+                        image_fn = os.path.join(self.assets_dir,
+                                                '{:s}-val-e{:03d}.png'.format(self.dataset_type, e+1))
+                        asset_writer.submit(utils.validation, val_out, self.val_block_size, image_fn,
+                                            color_mode='L')
+
+                # generator quality, written after every evaluation so a stopped run keeps its history
+                metrics = self.evaluate_epoch(sess, e + 1, g_steps)
+                if metrics is not None:
+                    self.metrics.append(metrics)
+                    metrics_fn = os.path.join(self.assets_dir, '{:s}-metrics.json'.format(self.dataset_type))
+                    asset_writer.submit(utils.save_json, list(self.metrics), metrics_fn)
+
+                    is_best, stop_reason = self.early_stopping.update(metrics)
+                    if is_best:
+                        with self.profiler.phase('checkpoint'):
+                            state = self.train_state(e + 1, 0, steps, g_steps, losses, start_time, **samples)
+                            self.best_checkpointer.save(sess, steps, state)
+                    if stop_reason is not None:
+                        print('Stopping after epoch {:d}: {:s}'.format(e + 1, stop_reason))
+
+                e, ii = e + 1, 0
+
+                # checkpoint every few epochs
+                if self.checkpointer.epoch_due(e - 1):
+                    with self.profiler.phase('checkpoint'):
+                        state = self.train_state(e, ii, steps, g_steps, losses, start_time, **samples)
+                        self.checkpointer.save(sess, steps, state)
+                    last_ckpt_steps = steps
+
+            # and where training stopped
+            if last_ckpt_steps != steps:
+                state = self.train_state(e, ii, steps, g_steps, losses, start_time, **samples)
+                self.checkpointer.save(sess, steps, state)
+
+            end_time = time.time()
+            elapsed_time = end_time - start_time
+            print('Trained {:d} steps, {:d} generator steps in {:.1f}s'.format(steps, g_steps, elapsed_time))
+            if self.early_stopping.best_epoch is not None:
+                print('Best {:s}: {:.5f} at epoch {:d}, checkpoint in {:s}'.format(
+                    self.early_stopping.monitor, self.early_stopping.best_value, self.early_stopping.best_epoch,
+                    self.best_checkpointer.ckpt_dir))
+
+            # where the steps of this run spent their time
+            self.profiler.export(os.path.join(self.assets_dir, '{:s}-profile'.format(self.dataset_type)))
+
+            # save losses as image
+            losses_fn = os.path.join(self.assets_dir, '{:s}-losses.png'.format(self.dataset_type))
+            asset_writer.submit(utils.save_losses, losses, self.loss_labels, elapsed_time, losses_fn)
+        return
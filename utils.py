@@ -1,9 +1,16 @@
-import os
+import json
+import zlib
+import struct
+import queue
+import threading
+import traceback
+import contextlib
 import tensorflow as tf
 import numpy as np
-import matplotlib.pyplot as plt
-from tensorflow.examples.tutorials.mnist import input_data
-from scipy.misc import toimage
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+import dataset
 
 
 # shorten cross entropy loss calculations
@@ -15,8 +22,28 @@ def celoss_zeros(logits):
     return tf.reduce_mean(tf.nn.sigmoid_cross_entropy_with_logits(logits=logits, labels=tf.zeros_like(logits)))
 
 
-def get_perturbed_batch(minibatch):
-    return minibatch + 0.5 * minibatch.std() * np.random.random(minibatch.shape)
+# custom getter that reads trainable variables again at the point of use, instead of reusing the
+# snapshot created with the variable, so the read honours the surrounding control dependencies
+def fresh_read_getter(getter, *args, **kwargs):
+    var = getter(*args, **kwargs)
+    if kwargs.get('trainable', True) is False:
+        return var
+    return var.read_value()
+
+
+# everything built inside runs after `ops` and sees the variable values they produced
+@contextlib.contextmanager
+def run_after(ops):
+    with tf.control_dependencies(ops):
+        with tf.variable_scope(tf.get_variable_scope(), custom_getter=fresh_read_getter):
+            yield
+
+
+# DRAGAN perturbation: x + 0.5 * std(x) * U[0, 1), std over the whole batch
+def perturb(minibatch):
+    mean = tf.reduce_mean(minibatch)
+    std = tf.sqrt(tf.reduce_mean(tf.square(minibatch - mean)))
+    return minibatch + 0.5 * std * tf.random_uniform(tf.shape(minibatch))
 
 
 # mnist datset loader
@@ -24,53 +51,145 @@ def get_mnist(mnist_base_dir, mnist_type):
     if not (mnist_type == 'original-MNIST' or mnist_type == 'fashion-MNIST'):
         raise ValueError('Either "original-MNIST" or "fashion-MNIST"')
 
-    mnist = input_data.read_data_sets(os.path.join(mnist_base_dir, mnist_type), one_hot=True)
+    # decoded once per (mnist_base_dir, mnist_type) and shared as read-only uint8 arrays
+    mnist = dataset.load_mnist(mnist_base_dir, mnist_type)
     return mnist
 
 
+# tile [n, h, w, c] images in [-1, 1] into one uint8 image of (rows, cols) tiles with `padding` pixels
+# around every tile, a single strided copy into a preallocated buffer
+def make_grid(images, grid_shape=None, padding=0, pad_value=0):
+    n, h, w, c = images.shape
+    if grid_shape is None:
+        cols = int(np.ceil(np.sqrt(n)))
+        rows = (n + cols - 1) // cols
+    else:
+        rows, cols = grid_shape
+    if rows * cols < n:
+        raise ValueError('{:d}x{:d} grid is too small for {:d} images'.format(rows, cols, n))
+
+    grid = np.full((rows * (h + padding) + padding, cols * (w + padding) + padding, c), pad_value, dtype=np.uint8)
+
+    # the grid seen as [rows, h, cols, w, c], skipping the padding
+    s0, s1, s2 = grid.strides
+    tiles = np.lib.stride_tricks.as_strided(grid[padding:, padding:], shape=(rows, h, cols, w, c),
+                                            strides=((h + padding) * s0, s0, (w + padding) * s1, s1, s2))
+
+    # [-1, 1] ==> [0, 255], full rows first, then what is left for the last row
+    n_full_rows = n // cols
+    n_rest = n - n_full_rows * cols
+    full_rows = images[:n_full_rows * cols].reshape(n_full_rows, cols, h, w, c)
+    np.copyto(tiles[:n_full_rows], ((full_rows + 1.0) * 127.5).transpose(0, 2, 1, 3, 4), casting='unsafe')
+    if n_rest > 0:
+        rest = images[n_full_rows * cols:]
+        np.copyto(tiles[n_full_rows, :, :n_rest], ((rest + 1.0) * 127.5).transpose(1, 0, 2, 3), casting='unsafe')
+    return grid
+
+
+# minimal PNG encoder for [h, w] or [h, w, c] uint8 images with 1 (gray), 3 (RGB) or 4 (RGBA) channels
+def write_png(fn, image, compress_level=6):
+    if image.ndim == 2:
+        image = image[:, :, np.newaxis]
+    h, w, c = image.shape
+    color_types = {1: 0, 3: 2, 4: 6}
+    if c not in color_types:
+        raise ValueError('Either 1, 3 or 4 channels')
+
+    # every scanline starts with its filter type, 0: none
+    raw = np.zeros((h, 1 + w * c), dtype=np.uint8)
+    raw[:, 1:] = image.reshape(h, w * c)
+
+    def chunk(tag, data):
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff)
+
+    with open(fn, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        f.write(chunk(b'IHDR', struct.pack('>IIBBBBB', w, h, 8, color_types[c], 0, 0, 0)))
+        f.write(chunk(b'IDAT', zlib.compress(raw, compress_level)))
+        f.write(chunk(b'IEND', b''))
+
+
+def save_image_grid(images, image_fn, grid_shape=None, padding=0, pad_value=0):
+    write_png(image_fn, make_grid(images, grid_shape, padding, pad_value))
+
+
 # gan validation function
 def validation(val_out, val_block_size, image_fn, color_mode):
-    def preprocess(img):
-        img = ((img + 1.0) * 127.5).astype(np.uint8)
-        return img
-
-    preprocesed = preprocess(val_out)
-    final_image = np.array([])
-    single_row = np.array([])
-    for b in range(val_out.shape[0]):
-        # concat image into a row
-        if single_row.size == 0:
-            single_row = preprocesed[b, :, :, :]
-        else:
-            single_row = np.concatenate((single_row, preprocesed[b, :, :, :]), axis=1)
-
-        # concat image row to final_image
-        if (b+1) % val_block_size == 0:
-            if final_image.size == 0:
-                final_image = single_row
-            else:
-                final_image = np.concatenate((final_image, single_row), axis=0)
-
-            # reset single row
-            single_row = np.array([])
-
-    if final_image.shape[2] == 1:
-        final_image = np.squeeze(final_image, axis=2)
-    toimage(final_image, mode=color_mode).save(image_fn)
-
-
-# save losses
+    n_channels = {'L': 1, 'RGB': 3}
+    if n_channels.get(color_mode) != val_out.shape[3]:
+        raise ValueError('color mode {:s} does not match {:d} channels'.format(color_mode, val_out.shape[3]))
+
+    save_image_grid(val_out, image_fn, grid_shape=(val_block_size, val_block_size))
+
+
+# save losses, with the object oriented matplotlib api so it is safe to call from the asset writer thread
 def save_losses(losses, labels, elapsed_time, fn):
-    fig, ax = plt.subplots()
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(1, 1, 1)
     losses = np.array(losses)
 
     for col in range(losses.shape[1]):
-        plt.plot(losses.T[col], label=labels[col], alpha=0.5)
+        ax.plot(losses.T[col], label=labels[col], alpha=0.5)
 
-    plt.legend(loc='upper right', bbox_to_anchor=(0.5, 0.5))
     elapsed_time_fn = 'elapsed: {:.3f}s'.format(elapsed_time)
-    plt.text(0.2, 0.9, elapsed_time_fn, ha='center', va='center', transform=ax.transAxes)
-    plt.title("Training Losses")
-    plt.legend()
-    plt.savefig(fn)
-    plt.close(fig)
+    ax.text(0.2, 0.9, elapsed_time_fn, ha='center', va='center', transform=ax.transAxes)
+    ax.set_title("Training Losses")
+    ax.legend()
+    fig.savefig(fn)
+
+
+# small results (metrics, summaries) as json, also from the asset writer thread
+def save_json(obj, fn):
+    with open(fn, 'w') as f:
+        json.dump(obj, f, indent=2)
+
+
+# writes assets (sample grids, loss plots) on a background thread so training does not wait for the disk,
+# the bounded queue blocks the trainer only when the disk falls that far behind
+class AssetWriter(object):
+    def __init__(self, max_pending=8):
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.errors = []
+        self.thread = threading.Thread(target=self._run, name='asset-writer', daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                self.queue.task_done()
+                return
+
+            fn, args, kwargs = job
+            try:
+                fn(*args, **kwargs)
+            except Exception as e:
+                traceback.print_exc()
+                self.errors.append(e)
+            finally:
+                self.queue.task_done()
+
+    def submit(self, fn, *args, **kwargs):
+        # arrays handed over must not be modified afterwards
+        if self.errors:
+            raise RuntimeError('asset writer failed: {}'.format(self.errors[0]))
+        self.queue.put((fn, args, kwargs))
+
+    def flush(self):
+        self.queue.join()
+
+    def close(self):
+        # write everything still queued before returning
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+        if exc_type is None and self.errors:
+            raise RuntimeError('asset writer failed: {}'.format(self.errors[0]))
+        return False